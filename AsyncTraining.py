@@ -0,0 +1,252 @@
+"""
+Asynchronous actor-learner training. params['async_actors'] actor processes
+step their own robots and write transitions into a shared-memory ring, while
+the calling process learns from them:
+
+	actors --SharedTransitions--> learner: on_new_sample + TrainingScheduler
+	actors <--SharedWeights------ learner: Q-network weights and epsilon
+
+The learner ingests transitions in arrival order and runs the update
+schedule of Shared.train_agent_and_sample_performance for every one of
+them. Acting overlaps learning:
+	- actors may run at most params['async_max_pending'] transitions ahead of
+	  the learner (the ring blocks them), which bounds how old the data the
+	  learner trains on is relative to the actors;
+	- the learner publishes its weights every
+	  params['async_weight_sync_interval'] gradient steps and actors adopt
+	  them before their next action, which bounds how old the policy is;
+	- while the ring is empty the learner keeps training on its replay
+	  memory, up to params['async_max_update_ratio'] times the gradient steps
+	  the schedule has made so far. At the default of 1 it waits instead,
+	  which keeps the synchronous update-to-data ratio.
+Episodes are handed out to actors in order, so every episode index is run
+exactly once and the returned rewards are in episode order. Which actor
+runs an episode, and how transitions of different actors interleave, depends
+on timing, so runs with more than one actor are not reproducible per seed.
+"""
+import random
+import multiprocessing
+import numpy as np
+import torch
+import Shared
+import WheelChair
+import Profiler
+
+class SharedTransitions():
+	"""
+	Fixed-capacity ring of transitions in shared memory with any number of
+	writers and one reader. Writers block while the ring is full.
+	"""
+	def __init__(self, context, capacity, state_size):
+		self.capacity = capacity
+		self.state_size = state_size
+		self.states = context.RawArray('f', capacity * state_size)
+		self.next_states = context.RawArray('f', capacity * state_size)
+		self.rewards = context.RawArray('d', capacity)
+		self.actions = context.RawArray('q', capacity)
+		self.episodes = context.RawArray('q', capacity)
+		self.steps = context.RawArray('q', capacity)
+		self.written = context.RawValue('q', 0)
+		self.lock = context.Lock()
+		self.free_slots = context.Semaphore(capacity)
+		self.filled_slots = context.Semaphore(0)
+		self.read = 0
+
+	def arrays(self):
+		# NumPy views, created on first use in every process
+		if not hasattr(self, 'views'):
+			self.views = (np.frombuffer(self.states, dtype=np.float32).reshape(self.capacity, self.state_size),
+						np.frombuffer(self.next_states, dtype=np.float32).reshape(self.capacity, self.state_size),
+						np.frombuffer(self.rewards, dtype=np.float64), np.frombuffer(self.actions, dtype=np.int64),
+						np.frombuffer(self.episodes, dtype=np.int64), np.frombuffer(self.steps, dtype=np.int64))
+		return self.views
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state.pop('views', None)
+		return state
+
+	def put(self, state, action, reward, next_state, episode, step):
+		states, next_states, rewards, actions, episodes, steps = self.arrays()
+		self.free_slots.acquire()
+		with self.lock:
+			slot = self.written.value % self.capacity
+			states[slot] = state
+			next_states[slot] = next_state
+			rewards[slot] = reward
+			actions[slot] = action
+			episodes[slot] = episode
+			steps[slot] = step
+			self.written.value += 1
+		self.filled_slots.release()
+
+	def get(self, timeout=None):
+		"""
+		Wait for the next transition and return it, or None after timeout seconds.
+		"""
+		states, next_states, rewards, actions, episodes, steps = self.arrays()
+		if not self.filled_slots.acquire(timeout=timeout):
+			return None
+		slot = self.read % self.capacity
+		transition = (states[slot].copy(), int(actions[slot]), float(rewards[slot]), next_states[slot].copy(), int(episodes[slot]), int(steps[slot]))
+		self.read += 1
+		self.free_slots.release()
+		return transition
+
+class SharedWeights():
+	"""
+	Q-network parameters and epsilon published by the learner, guarded by a
+	sequence number that is odd while a publication is in progress.
+	"""
+	def __init__(self, context, model):
+		self.size = sum(parameter.numel() for parameter in model.parameters())
+		self.buffer = context.RawArray('f', self.size)
+		self.epsilon = context.RawValue('d', 0.0)
+		self.version = context.RawValue('q', 0)
+		self.pulled_version = 0
+
+	def publish(self, agent):
+		self.version.value += 1
+		np.frombuffer(self.buffer, dtype=np.float32)[:] = torch.nn.utils.parameters_to_vector(agent.model.parameters()).detach().cpu().numpy()
+		self.epsilon.value = agent.epsilon
+		self.version.value += 1
+
+	def pull(self, agent):
+		"""
+		Copy the latest publication into agent unless it already has it.
+		"""
+		while True:
+			version = self.version.value
+			if version == self.pulled_version or version % 2 == 1:
+				return
+			vector = torch.from_numpy(np.frombuffer(self.buffer, dtype=np.float32).copy())
+			epsilon = self.epsilon.value
+			if self.version.value == version:
+				break
+		with torch.no_grad():
+			torch.nn.utils.vector_to_parameters(vector, agent.model.parameters())
+		agent.epsilon = epsilon
+		self.pulled_version = version
+
+class ActorPolicy():
+	"""
+	Epsilon-greedy policy of an actor: a copy of the learner's Q network
+	without the replay memory, holders or optimizers of a full agent.
+	"""
+	def __init__(self, model_type, params):
+		self.model = model_type(params)
+		self.epsilon = params['epsilon']
+		self.number_of_actions = params['number_of_actions']
+
+	def select_action_index(self, state):
+		if random.uniform(0, 1) < self.epsilon:
+			return np.random.choice(self.number_of_actions)
+		with torch.no_grad():
+			state_tensor = torch.from_numpy(np.asarray(state, dtype=np.float32)[np.newaxis, :])
+			return int(torch.argmax(self.model(state_tensor)[0]))
+
+def run_actor(params, model_type, seed, transitions, weights, next_episode, episode_rewards):
+	"""
+	Actor process: runs whole episodes until params['episodes'] have been handed out.
+	"""
+	torch.set_num_threads(1)
+	Shared.set_seed(seed)
+	agent = ActorPolicy(model_type, params)
+	while True:
+		with next_episode.get_lock():
+			episode = next_episode.value
+			next_episode.value += 1
+		if episode >= params['episodes']:
+			return
+		robot = WheelChair.WheelChairRobot(t_interval = 1.0,theta=random.uniform(-3.14, 3.14), phi=random.uniform(-3.14, 3.14), psi=random.uniform(-3.14, 3.14), integration=params['integration'])
+		curr_x = robot.x
+		current_state = robot.state
+		total_reward = 0
+		for step in range(params['episode_length']):
+			weights.pull(agent)
+			action = agent.select_action_index(current_state)
+			phidot, psidot = Shared.get_action_from_index(action, params['action_lowest'], params['action_highest'], params['action_bins'])
+			robot.move((phidot, psidot))
+			reward = robot.x - curr_x
+			total_reward += reward
+			new_state = robot.state
+			transitions.put(current_state, action, reward, new_state, episode, step)
+			current_state = new_state
+			curr_x = robot.x
+		episode_rewards[episode] = total_reward
+
+def train_agent_and_sample_performance(agent, params, run_iteration):
+	"""
+	Asynchronous counterpart of Shared.train_agent_and_sample_performance.
+	"""
+	context = multiprocessing.get_context('spawn')
+	transitions = SharedTransitions(context, params['async_max_pending'], params['state_size'])
+	weights = SharedWeights(context, agent.model)
+	next_episode = context.Value('q', 0)
+	episode_rewards = context.RawArray('d', params['episodes'])
+	scheduler = Shared.TrainingScheduler(params)
+	Profiler.configure(params['profile_path'], params['profile_trace_path'])
+
+	weights.publish(agent)
+	published_iteration = agent.current_iteration
+
+	def publish_if_due():
+		nonlocal published_iteration
+		if agent.current_iteration - published_iteration >= params['async_weight_sync_interval']:
+			with Profiler.phase('publish_weights'):
+				weights.publish(agent)
+			published_iteration = agent.current_iteration
+	actor_seeds = np.random.randint(0, 2 ** 31 - 1, params['async_actors'])
+	actors = [context.Process(target=run_actor, args=(params, type(agent.model), int(seed), transitions, weights, next_episode, episode_rewards))
+			  for seed in actor_seeds]
+	for actor in actors:
+		actor.start()
+
+	started_episodes = 0
+	extra_gradient_steps = 0
+	episode_totals = {} # rewards of the episodes in flight, summed from their transitions
+	try:
+		for _ in range(params['episodes'] * params['episode_length']):
+			transition = transitions.get(timeout=0)
+			while transition is None:
+				if scheduler.env_steps > 0 and extra_gradient_steps < (params['async_max_update_ratio'] - 1) * scheduler.scheduled_gradient_steps():
+					with Profiler.phase('extra_replay_mem'):
+						agent.replay_mem(params['batch_size'])
+					Profiler.count('extra_gradient_steps')
+					extra_gradient_steps += 1
+				else:
+					with Profiler.phase('wait_for_transition'):
+						transition = transitions.get(timeout=1.0)
+					if transition is None and any(actor.exitcode not in (None, 0) for actor in actors):
+						raise RuntimeError(f'actor process failed with exit code {[actor.exitcode for actor in actors]}')
+					continue
+				publish_if_due()
+				transition = transitions.get(timeout=0)
+			state, action, reward, next_state, episode, step = transition
+			episode_totals[episode] = episode_totals.get(episode, 0.0) + reward
+			Profiler.count('env_steps')
+			while started_episodes <= episode:
+				with Profiler.phase('on_episode_start'):
+					agent.on_episode_start(started_episodes)
+				if started_episodes % 10 == 0:
+					print(f'{run_iteration}th running, epidoes: {started_episodes}')
+				started_episodes += 1
+			with Profiler.phase('on_new_sample'):
+				agent.on_new_sample(state, action, reward, next_state)
+			scheduler.on_env_step(agent)
+			publish_if_due()
+			if step == params['episode_length'] - 1:
+				agent.on_terminated()
+				# actors' episodes interleave, so the aggregates cover the learner's work since the previous episode ended
+				Profiler.end_episode(run=run_iteration, episode=episode, reward=episode_totals.pop(episode))
+	except BaseException:
+		# actors may be blocked on a full ring
+		for actor in actors:
+			actor.terminate()
+		raise
+	finally:
+		for actor in actors:
+			actor.join()
+	agent.on_finished()
+	Profiler.write_trace(run_iteration)
+	return list(episode_rewards)
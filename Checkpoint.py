@@ -0,0 +1,97 @@
+"""
+Periodic checkpoints of a training run, one directory per seed:
+	latest.json             - {"episode": n} of the newest complete checkpoint
+	episode_<n>/state.pt    - networks, optimizers, counters, RNG states
+	episode_<n>/<name>.npy  - large NumPy arrays (replay memory, holders)
+Large arrays are saved with a single np.save each and reloaded memory-mapped
+copy-on-write, so a resumed agent shares their pages with the page cache
+instead of reading them into private memory. Every checkpoint goes to a new
+directory and latest.json is replaced atomically, so a crash while saving
+leaves the previous checkpoint usable.
+"""
+import os
+import json
+import random
+import shutil
+import numpy as np
+import torch
+
+LATEST_FILE = 'latest.json'
+STATE_FILE = 'state.pt'
+ARRAY_MIN_BYTES = 1 << 16 # smaller arrays are pickled into state.pt
+
+class ArrayFile:
+	def __init__(self, name):
+		self.name = name
+
+def split_arrays(state, directory, prefix=''):
+	"""
+	Save the large arrays of a nested dict to directory and replace them with ArrayFile placeholders.
+	"""
+	if isinstance(state, dict):
+		return {key: split_arrays(value, directory, f'{prefix}{key}.') for key, value in state.items()}
+	if isinstance(state, np.ndarray) and state.dtype != object and state.nbytes >= ARRAY_MIN_BYTES:
+		name = prefix[:-1]
+		np.save(os.path.join(directory, f'{name}.npy'), state)
+		return ArrayFile(name)
+	return state
+
+def join_arrays(state, directory):
+	if isinstance(state, dict):
+		return {key: join_arrays(value, directory) for key, value in state.items()}
+	if isinstance(state, ArrayFile):
+		return np.load(os.path.join(directory, f'{state.name}.npy'), mmap_mode='c')
+	return state
+
+def get_rng_state():
+	return {'random': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state(),
+			'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}
+
+def set_rng_state(state):
+	random.setstate(state['random'])
+	np.random.set_state(state['numpy'])
+	torch.set_rng_state(state['torch'])
+	if state['cuda'] is not None:
+		torch.cuda.set_rng_state_all(state['cuda'])
+
+def read_latest(path):
+	latest_path = os.path.join(path, LATEST_FILE)
+	if not os.path.exists(latest_path):
+		return None
+	with open(latest_path, 'r') as file:
+		return json.load(file)['episode']
+
+def save(path, episode, state):
+	"""
+	Write state as the checkpoint after episode and drop the older checkpoints.
+	"""
+	directory = os.path.join(path, f'episode_{episode}')
+	shutil.rmtree(directory, ignore_errors=True)
+	os.makedirs(directory)
+	torch.save(split_arrays(state, directory), os.path.join(directory, STATE_FILE))
+
+	temporary_path = os.path.join(path, LATEST_FILE + '.tmp')
+	with open(temporary_path, 'w') as file:
+		json.dump({'episode': episode}, file)
+		file.flush()
+		os.fsync(file.fileno())
+	os.replace(temporary_path, os.path.join(path, LATEST_FILE))
+
+	# arrays of a checkpoint we resumed from may still be mapped; unlinking them is safe
+	for name in os.listdir(path):
+		if name.startswith('episode_') and name != f'episode_{episode}':
+			shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+def load(path):
+	"""
+	:return: the newest checkpoint state at path, or None if there is none
+	"""
+	episode = read_latest(path)
+	if episode is None:
+		return None
+	directory = os.path.join(path, f'episode_{episode}')
+	state = torch.load(os.path.join(directory, STATE_FILE), weights_only=False)
+	return join_arrays(state, directory)
+
+def remove(path):
+	shutil.rmtree(path, ignore_errors=True)
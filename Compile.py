@@ -0,0 +1,61 @@
+import warnings
+import torch
+
+class CompiledLoss():
+    """
+    Wraps a loss function (forward passes and loss, returning the loss first)
+    in torch.compile with dynamic shapes, so the variable equivalence batch
+    does not recompile it. Backward, the optimizer step and target syncs stay
+    eager in the caller; torch.compile cannot capture them without graph
+    breaks. The first check_calls calls also run the eager function and
+    compare outputs and parameter gradients; on an error or a mismatch the
+    loss falls back to eager.
+    """
+    def __init__(self, loss_function, modules, tolerance=1e-5, check_calls=3):
+        self.loss_function = loss_function
+        self.parameters = [parameter for module in modules for parameter in module.parameters()]
+        self.tolerance = tolerance
+        self.check_calls = check_calls
+        try:
+            self.compiled_loss_function = torch.compile(loss_function, dynamic=True)
+        except Exception as error:
+            warnings.warn(f'torch.compile unavailable, loss runs eagerly: {error}')
+            self.compiled_loss_function = None
+
+    def __call__(self, *args):
+        if self.compiled_loss_function is None:
+            return self.loss_function(*args)
+        if self.check_calls > 0:
+            return self.check(*args)
+        return self.compiled_loss_function(*args)
+
+    def fall_back(self, reason, args):
+        warnings.warn(f'compiled loss disabled, {reason}')
+        self.compiled_loss_function = None
+        return self.loss_function(*args)
+
+    def gradients(self, loss):
+        return torch.autograd.grad(loss, self.parameters, allow_unused=True)
+
+    def close(self, eager, compiled):
+        if eager is None or compiled is None:
+            return eager is None and compiled is None
+        return torch.allclose(eager, compiled, atol=self.tolerance, rtol=self.tolerance)
+
+    def check(self, *args):
+        """
+        The compiled backward frees its graph, so the compared outputs are
+        thrown away and the loss is computed once more for the caller.
+        """
+        eager_outputs = self.loss_function(*args)
+        eager_gradients = self.gradients(eager_outputs[0])
+        try:
+            compiled_outputs = self.compiled_loss_function(*args)
+            compiled_gradients = self.gradients(compiled_outputs[0])
+        except Exception as error:
+            return self.fall_back(f'compilation failed: {error}', args)
+        if not all(self.close(eager, compiled) for eager, compiled in zip(eager_outputs, compiled_outputs)) or \
+                not all(self.close(eager, compiled) for eager, compiled in zip(eager_gradients, compiled_gradients)):
+            return self.fall_back('its outputs or gradients differ from the eager loss', args)
+        self.check_calls -= 1
+        return self.compiled_loss_function(*args)
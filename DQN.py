@@ -1,10 +1,12 @@
 import random
 import numpy as np
-import collections
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+from ReplayMemory import make_replay_memory
+from Compile import CompiledLoss
+import Profiler
 DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 class QNetwork(nn.Module):
@@ -27,7 +29,7 @@ class DQNAgent():
     def __init__(self, params):
         super().__init__()
         self.gamma = params['gamma']
-        self.memory = collections.deque(maxlen=params['memory_size'])
+        self.memory = make_replay_memory(params, params['memory_size'])
         self.action_bins = params['action_bins']
         self.epsilon = params['epsilon']
         self.epsilon_decay = params['epsilon_decay']
@@ -40,13 +42,16 @@ class DQNAgent():
         self.target_model_update_iterations = params['target_model_update_iterations']
         self.optimizer = optim.Adam(self.model.parameters(), weight_decay=params['weight_decay'], lr=params['learning_rate'])
         self.current_iteration = 0
+        self.q_loss = self.compute_q_loss
+        if params['compile_training_step'] == True:
+            self.q_loss = CompiledLoss(self.compute_q_loss, [self.model])
 
     def on_new_sample(self, state, action, reward, next_state):
         """
         Store the <state, action, reward, next_state> tuple in a 
         memory buffer for replay memory.
         """
-        self.memory.append((state, action, reward, next_state))
+        self.memory.append(state, action, reward, next_state)
 
     def on_finished(self):
         pass
@@ -55,29 +60,49 @@ class DQNAgent():
         pass
 
     def replay_mem(self, batch_size):
-        if len(self.memory) > batch_size:
-            minibatch = random.sample(self.memory, batch_size)
-        else:
-            minibatch = self.memory
+        indices = self.memory.sample_indices(batch_size)
+        states_tensor, actions_tensor, rewards_tensor, next_states_tensor = self.memory.get(indices)
+        weights_tensor = torch.from_numpy(self.memory.importance_weights(indices)).to(DEVICE)
 
         self.model.train()
         torch.set_grad_enabled(True)
+        self.current_iteration = self.current_iteration + 1
+        sync_target = self.current_iteration % self.target_model_update_iterations == 0
+        with Profiler.phase('q_update'):
+            td_errors = self.q_update(states_tensor, actions_tensor, rewards_tensor, next_states_tensor, weights_tensor, sync_target)
+        self.memory.update_priorities(indices, td_errors.cpu().numpy())
+
+    def q_update(self, states_tensor, actions_tensor, rewards_tensor, next_states_tensor, weights_tensor, sync_target):
+        """
+        :param weights_tensor: importance-sampling weight of every sample (ones for uniform replay)
+        :return: TD errors of the samples
+        """
         self.optimizer.zero_grad()
-        states, actions, rewards, next_states = zip(*minibatch)
-        states_tensor = torch.tensor(states, dtype=torch.float32).to(DEVICE)
-        with torch.no_grad():
-            targets = self.get_targets(rewards, next_states)
-        outputs = self.model.forward(states_tensor)
-        outputs_selected = outputs[torch.arange(len(minibatch)), actions]
-        loss = F.mse_loss(outputs_selected, targets)
+        loss, td_errors = self.q_loss(states_tensor, actions_tensor, rewards_tensor, next_states_tensor, weights_tensor)
         loss.backward()
         self.optimizer.step()
-        
-        # epsilon decay
+        if sync_target:
+            self.sync_target_model()
+        return td_errors.detach()
+
+    def compute_q_loss(self, states_tensor, actions_tensor, rewards_tensor, next_states_tensor, weights_tensor):
+        with torch.no_grad():
+            targets = self.get_targets(rewards_tensor, next_states_tensor)
+        outputs = self.model.forward(states_tensor)
+        outputs_selected = outputs.gather(1, actions_tensor.unsqueeze(-1)).squeeze(-1)
+        td_errors = outputs_selected - targets
+        return (weights_tensor * td_errors.pow(2)).mean(), td_errors
+
+    def sync_target_model(self):
+        with torch.no_grad():
+            for target_parameter, parameter in zip(self.target_model.parameters(), self.model.parameters()):
+                target_parameter.copy_(parameter)
+
+    def replay_abstract_model(self):
+        pass
+
+    def decay_epsilon(self):
         self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_minimum)
-        self.current_iteration = self.current_iteration + 1
-        if self.current_iteration % self.target_model_update_iterations == 0:
-            self.target_model.load_state_dict(self.model.state_dict())
 
     def select_action_index(self, state, apply_epsilon_random):
         if (apply_epsilon_random == True and random.uniform(0, 1) < self.epsilon):
@@ -88,14 +113,24 @@ class DQNAgent():
             prediction = self.model(state_tensor)
             return np.argmax(prediction.detach().cpu().numpy()[0])
 
-    def get_targets(self, rewards, next_states):
-        rewards_tensor = torch.tensor(rewards, dtype=torch.float32).to(DEVICE)
+    def get_targets(self, rewards_tensor, next_states_tensor):
         with torch.no_grad():
-            next_states_tensor = torch.tensor(next_states, dtype=torch.float32).to(DEVICE)
             q_values_next_states = self.target_model.forward(next_states_tensor)
             max_values, _ = torch.max(q_values_next_states, dim=1)
             targets = rewards_tensor + self.gamma * max_values # Q-Learning is off-policy
         return targets
 
     def on_terminated(self):
-        pass
\ No newline at end of file
+        pass
+
+    def state_dict(self):
+        return {'model': self.model.state_dict(), 'target_model': self.target_model.state_dict(), 'optimizer': self.optimizer.state_dict(),
+                'memory': self.memory.state_dict(), 'epsilon': self.epsilon, 'current_iteration': self.current_iteration}
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state['model'])
+        self.target_model.load_state_dict(state['target_model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.memory.load_state_dict(state['memory'])
+        self.epsilon = state['epsilon']
+        self.current_iteration = state['current_iteration']
\ No newline at end of file
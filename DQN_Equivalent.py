@@ -1,40 +1,386 @@
 import random
 import numpy as np
-import math
-import collections
+import multiprocessing
+from collections import OrderedDict
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-import matplotlib.pyplot as plt
-from sklearn.manifold import TSNE
-from PIL import Image, ImageDraw, ImageFont
-import matplotlib
-
-from collections import OrderedDict
-
-import numpy as np
 #pip install faiss
 import faiss
 import Shared
+from ReplayMemory import ReplayMemory, make_replay_memory
+from Compile import CompiledLoss
+import Profiler
+import Visualization
 
 class FaissKNeighbors:
-    def __init__(self, k=5):
-        self.index = None
-        self.y = None
+    """
+    Persistent KNN index over integer slot ids in [0, capacity).
+    Points are added, replaced and removed in place so callers only pay
+    for the entries that changed instead of rebuilding the whole index.
+    """
+    def __init__(self, k, dimension):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
         self.k = k
 
-    def fit(self, X, y):
-        self.index = faiss.IndexFlatL2(X.shape[1])
-        self.index.add(X.astype(np.float32))
-        self.y = y
-
-    def predict(self, X):
-        distances, indices = self.index.search(X.astype(np.float32), k=self.k + 1)
-        predictions = self.y[indices[0][1:]]
-        return predictions
+    def fit(self, ids, X):
+        self.index.reset()
+        self.add(ids, X)
+
+    def add(self, ids, X):
+        self.index.add_with_ids(np.ascontiguousarray(X, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+
+    def remove(self, ids):
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def update(self, ids, X):
+        """
+        Insert or replace the points stored under ids. When an id appears
+        more than once only its last point is kept.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        _, last = np.unique(ids[::-1], return_index=True)
+        last = len(ids) - 1 - last
+        self.remove(ids[last])
+        self.add(ids[last], np.asarray(X)[last])
+
+    def kneighbors(self, X):
+        """
+        :return: ids of the k nearest neighbours of every row of X, skipping the
+        closest hit (the query point itself). Missing neighbours are -1.
+        """
+        distances, indices = self.index.search(np.ascontiguousarray(X, dtype=np.float32), k=self.k + 1)
+        return indices[:, 1:]
+
+class IVFKNeighbors(FaissKNeighbors):
+    """
+    Inverted-file index: a query only scans the nprobe of nlist clusters
+    closest to it. Exact search is used until a fit has enough points to
+    train the clusters. They are retrained once the point count has doubled
+    since, and every retrain_interval fits because the embeddings drift
+    while the encoder trains; other fits only reassign the points.
+    """
+    training_points_per_list = 39 # below this FAISS warns that k-means is underfed
+
+    def __init__(self, k, dimension, nlist, nprobe, retrain_interval):
+        super().__init__(k, dimension)
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.retrain_interval = retrain_interval
+        self.trained_size = 0
+        self.fits_since_training = 0
+
+    def fit(self, ids, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if self.trained_size == 0 and len(X) < self.nlist * self.training_points_per_list:
+            return super().fit(ids, X)
+        self.fits_since_training += 1
+        if self.trained_size == 0 or len(X) >= 2 * self.trained_size or self.fits_since_training >= self.retrain_interval:
+            self.quantizer = faiss.IndexFlatL2(self.dimension)
+            self.index = faiss.IndexIVFFlat(self.quantizer, self.dimension, self.nlist)
+            self.index.set_direct_map_type(faiss.DirectMap.Hashtable) # O(1) remove_ids
+            self.index.nprobe = self.nprobe
+            self.index.train(X)
+            self.trained_size = len(X)
+            self.fits_since_training = 0
+        self.index.reset()
+        self.add(ids, X)
+
+    def add(self, ids, X):
+        super().add(ids, X)
+        # holders refreshed incrementally are only added, never fitted
+        if self.trained_size == 0 and self.index.ntotal >= self.nlist * self.training_points_per_list:
+            self.fit(faiss.vector_to_array(self.index.id_map), self.index.index.reconstruct_n(0, self.index.ntotal))
+
+class HNSWKNeighbors(FaissKNeighbors):
+    """
+    HNSW graph index. The graph cannot delete points, so points removed or
+    replaced since it was built are hidden from graph searches with an id
+    selector, and their new positions go to a small exact index searched
+    alongside it. The graph is rebuilt once the exact index holds more than
+    rebuild_min_points and rebuild_fraction of the graph's points, and every
+    rebuild_interval fits. Other fits move the graph's points in place: their
+    stored vectors are overwritten and the links, built from the earlier
+    embeddings, are kept for navigation.
+    """
+    def __init__(self, k, dimension, m, ef_search, rebuild_fraction, rebuild_min_points, rebuild_interval):
+        super().__init__(k, dimension) # self.index holds the points added since the graph was built
+        self.dimension = dimension
+        self.m = m
+        self.ef_search = max(ef_search, k + 1)
+        self.rebuild_fraction = rebuild_fraction
+        self.rebuild_min_points = rebuild_min_points
+        self.rebuild_interval = rebuild_interval
+        self.graph = faiss.IndexIDMap2(faiss.IndexHNSWFlat(dimension, m))
+        self.fits_since_build = 0
+        self.hidden = set()
+        self.search_parameters = None
+
+    def build(self, ids, X):
+        self.graph = faiss.IndexIDMap2(faiss.IndexHNSWFlat(self.dimension, self.m))
+        self.graph.add_with_ids(np.ascontiguousarray(X, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+        self.fits_since_build = 0
+        self.index.reset()
+        self.hidden.clear()
+        self.search_parameters = None
+
+    def fit(self, ids, X):
+        ids = np.asarray(ids, dtype=np.int64)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        self.fits_since_build += 1
+        if self.graph.ntotal == 0 or len(ids) == 0 or self.fits_since_build >= self.rebuild_interval:
+            return self.build(ids, X)
+        graph_ids = faiss.vector_to_array(self.graph.id_map)
+        positions = np.full(max(graph_ids.max(), ids.max()) + 1, -1, dtype=np.int64)
+        positions[graph_ids] = np.arange(len(graph_ids))
+        in_graph = positions[ids] >= 0
+        storage = faiss.downcast_index(faiss.downcast_index(self.graph.index).storage)
+        vectors = faiss.vector_to_array(storage.codes).view(np.float32).reshape(-1, self.dimension).copy()
+        vectors[positions[ids[in_graph]]] = X[in_graph]
+        faiss.copy_array_to_vector(vectors.view(np.uint8).ravel(), storage.codes)
+        self.hidden = set(graph_ids[~np.isin(graph_ids, ids[in_graph])].tolist())
+        self.search_parameters = None
+        self.index.reset()
+        self.add(ids[~in_graph], X[~in_graph])
+
+    def add(self, ids, X):
+        self.hide(ids)
+        super().add(ids, X)
+        if self.index.ntotal > max(self.rebuild_min_points, self.rebuild_fraction * self.graph.ntotal):
+            self.rebuild()
+
+    def remove(self, ids):
+        self.hide(ids)
+        super().remove(ids)
+
+    def hide(self, ids):
+        self.hidden.update(np.asarray(ids, dtype=np.int64).tolist())
+        self.search_parameters = None
+
+    def rebuild(self):
+        graph_ids = faiss.vector_to_array(self.graph.id_map)
+        visible = ~np.isin(graph_ids, np.fromiter(self.hidden, dtype=np.int64, count=len(self.hidden)))
+        ids = np.concatenate([graph_ids[visible], faiss.vector_to_array(self.index.id_map)])
+        X = np.concatenate([self.graph.index.reconstruct_n(0, self.graph.ntotal)[visible],
+                            self.index.index.reconstruct_n(0, self.index.ntotal)])
+        self.build(ids, X)
+
+    def get_search_parameters(self):
+        if self.search_parameters is None:
+            if len(self.hidden) == 0:
+                self.search_parameters = faiss.SearchParametersHNSW(efSearch=self.ef_search)
+            else:
+                # the selectors are kept as attributes, FAISS does not own them
+                self.hidden_selector = faiss.IDSelectorBatch(np.fromiter(self.hidden, dtype=np.int64, count=len(self.hidden)))
+                self.visible_selector = faiss.IDSelectorNot(self.hidden_selector)
+                self.search_parameters = faiss.SearchParametersHNSW(sel=self.visible_selector, efSearch=self.ef_search)
+        return self.search_parameters
+
+    def kneighbors(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        distances, indices = self.graph.search(X, k=self.k + 1, params=self.get_search_parameters())
+        if self.index.ntotal > 0:
+            new_distances, new_indices = self.index.search(X, k=self.k + 1)
+            distances = np.concatenate([distances, new_distances], axis=1)
+            indices = np.concatenate([indices, new_indices], axis=1)
+            order = np.argsort(distances, axis=1, kind='stable')[:, :self.k + 1]
+            indices = np.take_along_axis(indices, order, axis=1)
+        return indices[:, 1:]
+
+def make_knn_model(params):
+    k, dimension = params['K_for_KNN'], params['abstract_state_space_dimmension']
+    if params['knn_index'] == 'flat':
+        return FaissKNeighbors(k, dimension)
+    if params['knn_index'] == 'ivf':
+        return IVFKNeighbors(k, dimension, params['knn_nlist'], params['knn_nprobe'], params['knn_retrain_interval'])
+    if params['knn_index'] == 'hnsw':
+        return HNSWKNeighbors(k, dimension, params['knn_hnsw_m'], params['knn_ef_search'], params['knn_rebuild_fraction'],
+                              params['knn_rebuild_min_points'], params['knn_retrain_interval'])
+    raise ValueError(f"unknown knn_index {params['knn_index']}, expected 'flat', 'ivf' or 'hnsw'")
+
+def knn_recall(knn_model, ids, X, queries, exact_queries=None):
+    """
+    Fraction of the exact nearest neighbours of exact_queries (default
+    queries) among (ids, X) that knn_model returns for queries. Passing fresh
+    encodings as X and exact_queries measures the combined effect of
+    approximate search and stale embeddings.
+    """
+    exact_model = FaissKNeighbors(knn_model.k, X.shape[1])
+    exact_model.fit(ids, X)
+    expected = exact_model.kneighbors(queries if exact_queries is None else exact_queries)
+    found = knn_model.kneighbors(queries)
+    hits = sum(len(np.intersect1d(expected_row[expected_row >= 0], found_row)) for expected_row, found_row in zip(expected, found))
+    return hits / max(1, np.count_nonzero(expected >= 0))
+
+class RewardFixations:
+    """
+    Random fixed points in abstract space, one per abstract reward, stored as
+    rows of a table that grows when a new abstract reward appears. The
+    abstract rewards are kept sorted, so a batch of them is mapped to table
+    rows with one searchsorted.
+    """
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.table = torch.zeros(0, dimension)
+        self.abstract_rewards = np.zeros(0) # sorted
+        self.rows = np.zeros(0, dtype=np.int64) # table row of every entry of abstract_rewards
+
+    def __len__(self):
+        return len(self.table)
+
+    def add(self, abstract_reward):
+        position = np.searchsorted(self.abstract_rewards, abstract_reward)
+        if position < len(self.abstract_rewards) and self.abstract_rewards[position] == abstract_reward:
+            return
+        self.abstract_rewards = np.insert(self.abstract_rewards, position, abstract_reward)
+        self.rows = np.insert(self.rows, position, len(self.table))
+        self.table = torch.cat([self.table, torch.rand(1, self.dimension)])
+
+    def lookup(self, abstract_rewards):
+        """
+        :return: (batch, dimension) fixations of abstract rewards that have all been added
+        """
+        return self.table[torch.from_numpy(self.rows[np.searchsorted(self.abstract_rewards, abstract_rewards)])]
+
+    def labels(self):
+        """
+        :return: abstract reward of every table row
+        """
+        labels = np.empty(len(self.rows))
+        labels[self.rows] = self.abstract_rewards
+        return labels.tolist()
+
+    def state_dict(self):
+        return {'table': self.table, 'abstract_rewards': self.abstract_rewards, 'rows': self.rows}
+
+    def load_state_dict(self, state):
+        self.table = state['table']
+        self.abstract_rewards = state['abstract_rewards']
+        self.rows = state['rows']
+
+class AbstractStateHolders:
+    """
+    Fixed-capacity store of abstract next states keyed by
+    (state, action, abstract_reward). Every field lives in a preallocated
+    array indexed by slot, a dict maps keys (see make_keys) to slots, and
+    the least recently used slot is recycled once the store is full. Slots
+    are kept in use order in an OrderedDict so touching and evicting are O(1);
+    last_used records the same order for lru_order and checkpoints.
+    """
+    def __init__(self, capacity, state_size, abstract_state_size):
+        self.capacity = capacity
+        self.embeddings = np.zeros((capacity, abstract_state_size), dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.encoded_at = np.zeros(capacity, dtype=np.int64) # encoder version (abstraction steps) of each embedding
+        self.keys = np.empty(capacity, dtype=object)
+        self.slots = {}
+        self.recency = OrderedDict() # slot -> None, least recently used first
+        self.size = 0
+        self.clock = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    @staticmethod
+    def make_keys(states, actions, abstract_rewards):
+        """
+        Keys of a batch of (state, action, abstract_reward) rows: the bytes of
+        every row packed into one record. Adding 0.0 maps -0.0 to 0.0, which
+        would otherwise pack differently.
+        """
+        states = np.asarray(states, dtype=np.float32)
+        records = np.empty(len(states), dtype=[('state', np.float32, states.shape[1]), ('action', np.int64), ('reward', np.float64)])
+        records['state'] = states + np.float32(0.0)
+        records['action'] = actions
+        records['reward'] = np.asarray(abstract_rewards, dtype=np.float64) + 0.0
+        return records.view(np.dtype((np.void, records.dtype.itemsize))).tolist()
+
+    def get_slots(self, keys):
+        return np.array([self.slots[key] for key in keys], dtype=np.int64)
+
+    def touch(self, slot):
+        self.clock += 1
+        self.last_used[slot] = self.clock
+        self.recency[slot] = None
+        self.recency.move_to_end(slot)
+
+    def allocate(self, key):
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = next(iter(self.recency))
+            del self.slots[self.keys[slot]]
+        self.slots[key] = slot
+        self.keys[slot] = key
+        self.touch(slot)
+        return slot
+
+    def assign_slots(self, keys, states, actions, abstract_rewards):
+        """
+        Slots for keys (made from the given columns), allocating new ones for
+        unseen keys. Existing keys keep their LRU position. A key evicted by
+        a later key of the same batch gets slot -1.
+        """
+        new_rows = []
+        for row, key in enumerate(keys):
+            if key not in self.slots:
+                self.allocate(key)
+                new_rows.append(row)
+        new_rows = np.array(new_rows, dtype=np.int64)
+        slots = np.array([self.slots.get(key, -1) for key in keys], dtype=np.int64)
+        new_rows = new_rows[slots[new_rows] >= 0]
+        self.states[slots[new_rows]] = np.asarray(states)[new_rows]
+        self.actions[slots[new_rows]] = np.asarray(actions)[new_rows]
+        self.rewards[slots[new_rows]] = np.asarray(abstract_rewards)[new_rows]
+        return slots
+
+    def write(self, slots, embeddings, next_states, encoded_at):
+        self.embeddings[slots] = embeddings
+        self.next_states[slots] = next_states
+        self.encoded_at[slots] = encoded_at
+
+    def write_embeddings(self, slots, embeddings, encoded_at):
+        self.embeddings[slots] = embeddings
+        self.encoded_at[slots] = encoded_at
+
+    def lru_order(self):
+        return np.argsort(self.last_used[:self.size], kind='stable')
+
+    def state_dict(self):
+        return {'embeddings': self.embeddings, 'next_states': self.next_states, 'states': self.states, 'actions': self.actions,
+                'rewards': self.rewards, 'last_used': self.last_used, 'encoded_at': self.encoded_at, 'size': self.size, 'clock': self.clock}
+
+    def load_state_dict(self, state):
+        """
+        Adopts the arrays of state as they are and rebuilds the keys from the
+        (state, action, abstract_reward) columns they were unpacked into.
+        """
+        self.embeddings = state['embeddings']
+        self.next_states = state['next_states']
+        self.states = state['states']
+        self.actions = state['actions']
+        self.rewards = state['rewards']
+        self.last_used = state['last_used']
+        self.encoded_at = state['encoded_at']
+        self.capacity = len(self.embeddings)
+        self.size = state['size']
+        self.clock = state['clock']
+        self.keys = np.empty(self.capacity, dtype=object)
+        self.keys[:self.size] = self.make_keys(self.states[:self.size], self.actions[:self.size], self.rewards[:self.size])
+        self.slots = {key: slot for slot, key in enumerate(self.keys[:self.size])}
+        self.recency = OrderedDict((int(slot), None) for slot in self.lru_order())
 
 class QNetwork(nn.Module):
     def __init__(self, params):
@@ -51,13 +397,23 @@ class QNetwork(nn.Module):
 
 
 class ActionEncoder(nn.Module):
-    def __init__(self, n_dim, n_actions, hidden_dim1=128, hidden_dim2=128):
+    def __init__(self, n_dim, n_actions, hidden_dim1=128, hidden_dim2=128, factorized=True):
         super().__init__()
+        self.n_dim = n_dim
+        self.factorized = factorized
         self.linear1 = nn.Linear(n_dim+n_actions, hidden_dim1)
         self.linear2 = nn.Linear(hidden_dim1, hidden_dim2)
         self.linear3 = nn.Linear(hidden_dim2, n_dim)
 
     def forward(self, abstract_states, actions):
+        if self.factorized:
+            # linear1 on [state, action] == state projection + action projection,
+            # so the (states x actions) input is never materialized
+            state_projection = F.linear(abstract_states, self.linear1.weight[:, :self.n_dim], self.linear1.bias)
+            action_projection = F.linear(actions, self.linear1.weight[:, self.n_dim:])
+            za = F.relu(state_projection.unsqueeze(1) + action_projection.unsqueeze(0))
+            za = F.relu(self.linear2(za))
+            return self.linear3(za)
         abstract_states_for_all_actions = abstract_states.unsqueeze(1).repeat(1, len(actions), 1)
         actions_for_all_states = actions.unsqueeze(0).repeat(abstract_states.shape[0], 1, 1)
         za = torch.cat([abstract_states_for_all_actions, actions_for_all_states], dim=-1)
@@ -112,7 +468,7 @@ class DQNAgent():
     def __init__(self, params):
         super().__init__()
         self.gamma = params['gamma']
-        self.memory = collections.deque(maxlen=params['memory_size'])
+        self.memory = make_replay_memory(params, params['memory_size'])
         self.action_bins = params['action_bins']
         self.epsilon = params['epsilon']
         self.epsilon_decay = params['epsilon_decay']
@@ -127,243 +483,295 @@ class DQNAgent():
         self.params = params
 
         state_encoder = StateEncoder(params['state_size'], params['abstract_state_space_dimmension'])
-        action_encoder = ActionEncoder(params['abstract_state_space_dimmension'], params['number_of_actions'])
+        action_encoder = ActionEncoder(params['abstract_state_space_dimmension'], params['number_of_actions'], factorized=params['factorized_action_encoder'])
+        self.possible_actions_onehot_tensor = torch.eye(params['number_of_actions']).to(DEVICE)
         self.abstraction_model = Model(state_encoder, action_encoder)
         self.abstract_optimizer = optim.Adam(filter(lambda p: p.requires_grad, self.abstraction_model.parameters()), lr=self.params['abstraction_learning_rate'])
-        self.abstraction_memory = collections.deque(maxlen=params['memory_size_for_abstraction'])
+        self.abstraction_memory = ReplayMemory(params['memory_size_for_abstraction'], params['state_size'])
         self.abstraction_batch_size = params['batch_size_for_abstraction']
         self.loss_function = Loss()
-        self.abstract_state_holders = OrderedDict()
+        self.abstract_state_holders = AbstractStateHolders(params['abstract_state_holders_size'], params['state_size'], params['abstract_state_space_dimmension'])
+        self.knn_model = make_knn_model(params)
         self.equivalence_weight = params['equivalence_weight']
-        self.reward_fixation_in_abstraction = {}
+        self.reward_fixations = RewardFixations(params['abstract_state_space_dimmension'])
+        self.new_holder_slots = []
         self.current_iteration = 0
-
-    def get_abstract_reward(self, reward):
-        return round(reward * 0.5) / 0.5
+        self.abstraction_steps = 0
+        self.refresh_cursor = 0
+        self.holder_drift = 0.0
+        if params['holder_refresh'] not in ('full', 'incremental'):
+            raise ValueError(f"unknown holder_refresh {params['holder_refresh']}, expected 'full' or 'incremental'")
+        self.tsne_process = None
+        self.q_loss = self.compute_q_loss
+        self.abstraction_loss = self.compute_abstraction_loss
+        if params['compile_training_step'] == True:
+            self.q_loss = CompiledLoss(self.compute_q_loss, [self.model])
+            self.abstraction_loss = CompiledLoss(self.compute_abstraction_loss, [self.abstraction_model])
 
     def get_abstract_rewards(self, rewards):
-        return tuple(self.get_abstract_reward(reward) for index, reward in enumerate(rewards))
+        # rewards are kept as float32 in replay memory; np.round rounds half to even like round()
+        return np.round(np.asarray(rewards, dtype=np.float32) * 0.5) / 0.5 + 0.0
+
+    def get_abstract_reward(self, reward):
+        return float(self.get_abstract_rewards(reward))
 
     def on_new_sample(self, state, action, reward, next_state):
         abstract_reward = self.get_abstract_reward(reward)
-        if abstract_reward not in self.reward_fixation_in_abstraction:
-            with torch.no_grad():
-                self.reward_fixation_in_abstraction[abstract_reward] = torch.rand(self.params['abstract_state_space_dimmension'])
-        self.memory.append((state, action, reward, next_state))
-
-        self.abstraction_memory.append((state, action, reward, next_state))
-        abstract_state_holder_key = (tuple(state), action, abstract_reward)
-        if abstract_state_holder_key in self.abstract_state_holders:
-            self.abstract_state_holders.move_to_end(abstract_state_holder_key)
+        self.reward_fixations.add(abstract_reward)
+        self.memory.append(state, action, reward, next_state)
+
+        self.abstraction_memory.append(state, action, reward, next_state)
+        holders = self.abstract_state_holders
+        states = np.asarray(state, dtype=np.float32)[np.newaxis, :]
+        keys = holders.make_keys(states, [action], [abstract_reward])
+        if keys[0] in holders:
+            holders.touch(holders.slots[keys[0]])
         else:
-            with torch.no_grad():
-                next_state_tensor = torch.tensor(np.array(next_state)[np.newaxis, :], dtype=torch.float32).to(DEVICE)
-                abstract_next_state = self.abstraction_model.state_encoder(next_state_tensor)
-                self.abstract_state_holders[abstract_state_holder_key] = (abstract_next_state, next_state)
-                if len(self.abstract_state_holders) > self.params['abstract_state_holders_size']:
-                    self.abstract_state_holders.popitem(last=False)
+            # encoded together with the other new holders by encode_new_holders
+            slots = holders.assign_slots(keys, states, [action], [abstract_reward])
+            holders.next_states[slots] = next_state
+            self.new_holder_slots.append(slots[0])
+
+    def encode_new_holders(self):
+        """
+        Encode the holders added by on_new_sample since the last call in one
+        batch. Called before anything reads holder embeddings.
+        """
+        if len(self.new_holder_slots) == 0:
+            return
+        holders = self.abstract_state_holders
+        slots = np.unique(self.new_holder_slots)
+        self.new_holder_slots = []
+        with Profiler.phase('encode_new_holders'), torch.no_grad():
+            embeddings = self.abstraction_model.state_encoder(torch.from_numpy(holders.next_states[slots]).to(DEVICE)).cpu().numpy()
+        holders.write_embeddings(slots, embeddings, self.abstraction_steps)
+        self.knn_model.update(slots, embeddings)
 
     def on_finished(self):
-        pass
+        if self.tsne_process is not None:
+            self.tsne_process.join()
+            self.tsne_process = None
 
     def on_episode_start(self, episode_index):
-        self.update_all_in_abstract_state_holders()
+        self.encode_new_holders()
+        if self.params['holder_refresh'] == 'full':
+            with Profiler.phase('update_all_in_abstract_state_holders'):
+                self.update_all_in_abstract_state_holders()
+        if self.params['knn_recall_interval'] > 0 and episode_index % self.params['knn_recall_interval'] == 0 and len(self.abstract_state_holders) > 0:
+            self.measure_knn_recall(episode_index)
         if self.params['plot_t-sne'] == True and episode_index != 0 and (episode_index+1) % 20 == 0:
             self.draw_tsne(episode_index)
 
     def update_all_in_abstract_state_holders(self):
-        if len(self.abstract_state_holders) == 0:
+        holders = self.abstract_state_holders
+        if len(holders) == 0:
             return
-        next_states = [value[1] for value in self.abstract_state_holders.values()]
-        next_states_tensor = torch.tensor(next_states, dtype=torch.float32).to(DEVICE)
+        next_states_tensor = torch.from_numpy(holders.next_states[:holders.size]).to(DEVICE)
+        with torch.no_grad():
+            torch.from_numpy(holders.embeddings[:holders.size]).copy_(self.abstraction_model.state_encoder(next_states_tensor))
+        holders.encoded_at[:holders.size] = self.abstraction_steps
+        self.knn_model.fit(np.arange(holders.size), holders.embeddings[:holders.size])
+
+    def refresh_holders(self):
+        """
+        Re-encode params['holder_refresh_chunk'] holders, in round-robin or
+        oldest-first order. The mean distance the chunk's embeddings moved is
+        the encoder drift they had accumulated; above
+        params['holder_refresh_drift_threshold'] every holder is re-encoded.
+        """
+        holders = self.abstract_state_holders
+        if len(holders) == 0:
+            return
+        chunk = min(self.params['holder_refresh_chunk'], holders.size)
+        if self.params['holder_refresh_order'] == 'oldest':
+            slots = np.argpartition(holders.encoded_at[:holders.size], chunk - 1)[:chunk]
+        else:
+            slots = (self.refresh_cursor + np.arange(chunk)) % holders.size
+            self.refresh_cursor = (self.refresh_cursor + chunk) % holders.size
         with torch.no_grad():
-            updated_abstract_next_states = self.abstraction_model.state_encoder(next_states_tensor)
-        updated_abstract_next_states = updated_abstract_next_states.unsqueeze(1)
-        for (key, next_state), updated_abstract_next_state in zip(self.abstract_state_holders.items(), updated_abstract_next_states):
-            self.abstract_state_holders[key] = (updated_abstract_next_state, next_state[1])
+            embeddings = self.abstraction_model.state_encoder(torch.from_numpy(holders.next_states[slots]).to(DEVICE)).cpu().numpy()
+        self.holder_drift = float(np.linalg.norm(embeddings - holders.embeddings[slots], axis=1).mean())
+        threshold = self.params['holder_refresh_drift_threshold']
+        if threshold is not None and self.holder_drift > threshold:
+            Profiler.count('holder_full_refreshes')
+            self.update_all_in_abstract_state_holders()
+            return
+        holders.write_embeddings(slots, embeddings, self.abstraction_steps)
+        self.knn_model.update(slots, embeddings)
+        Profiler.count('holders_reencoded', chunk)
+
+    def measure_knn_recall(self, episode_index, queries=256):
+        """
+        Recall@K of the holder index against exact search over freshly
+        encoded holders, so it also reflects stale embeddings.
+        """
+        holders = self.abstract_state_holders
+        # own generator, so measuring does not change the training trajectory
+        query_slots = np.random.default_rng(episode_index).choice(holders.size, min(queries, holders.size), replace=False)
+        with torch.no_grad():
+            fresh_embeddings = self.abstraction_model.state_encoder(torch.from_numpy(holders.next_states[:holders.size]).to(DEVICE)).cpu().numpy()
+        recall = knn_recall(self.knn_model, np.arange(holders.size), fresh_embeddings, holders.embeddings[query_slots], fresh_embeddings[query_slots])
+        ages = self.abstraction_steps - holders.encoded_at[:holders.size]
+        Profiler.count('knn_recall', recall)
+        Profiler.count('holder_mean_age', float(ages.mean()))
+        print(f'episode {episode_index}: {self.params["knn_index"]} knn recall@{self.knn_model.k} {recall:.3f}, holder age mean {ages.mean():.1f} max {ages.max()}')
 
     def draw_tsne(self, episode_index):
-        matplotlib.use("Qt5Agg")
-        X = np.array([tensor[0].numpy().flatten() for tensor in self.abstract_state_holders.values()])
-
-        # Perform t-SNE
-        tsne = TSNE(n_components=2)
-        tsne_states = tsne.fit_transform(X)
-        if self.params['abstract_state_space_dimmension'] == 2:
-            tsne_states = X
-
-        tx_orig, ty_orig = tsne_states[:,0], tsne_states[:,1]
-        tx = (tx_orig-np.min(tx_orig)) / (np.max(tx_orig) - np.min(tx_orig))
-        ty = (ty_orig-np.min(ty_orig)) / (np.max(ty_orig) - np.min(ty_orig))
-
-        labels = list(self.abstract_state_holders.keys())
-        values = list(self.abstract_state_holders.values())
-        width = 16000
-        height = 16000
-        max_dim = 100
-
-        full_image = Image.new('RGBA', (width, height))
+        """
+        Render a (subsampled) snapshot of the holder embeddings to
+        params['t-sne_output_path'], in a background process if
+        params['t-sne_background'] is set.
+        """
+        holders = self.abstract_state_holders
+        slots = np.arange(holders.size)
+        if holders.size > self.params['t-sne_max_points']:
+            slots = np.sort(np.random.default_rng(episode_index).choice(holders.size, self.params['t-sne_max_points'], replace=False))
+        phidot, psidot = Shared.get_action_from_index(holders.actions[slots], self.params['action_lowest'], self.params['action_highest'], self.params['action_bins'])
+        snapshot = dict(output_path=self.params['t-sne_output_path'].format(episode=episode_index+1),
+                        title=f'Equivalent State Mapping on 2-D Euclidean Space After {episode_index+1}\'th episodes',
+                        embeddings=holders.embeddings[slots].copy(), states=holders.states[slots].copy(),
+                        action_values=np.stack([phidot, psidot], axis=1), next_states=holders.next_states[slots].copy(),
+                        color_by_next_state=self.params['t-sne_next_state'], max_labels=self.params['t-sne_max_labels'], seed=episode_index)
         if self.params['plot_reward_fixations'] == True:
-            rewards = np.array([tensor.numpy().flatten() for tensor in self.reward_fixation_in_abstraction.values()])
-            labels_rewards = list(self.reward_fixation_in_abstraction.keys())
-            if self.params['abstract_state_space_dimmension'] == 2:
-                tsne_rewards = rewards
-            else:
-                tsne_rewards = tsne.fit_transform(rewards)
-                print("WARNING: tsne rewards on higher than 2 dimmension is inaccurate")
-            tx_rewards_orig, ty_rewards_orig = tsne_rewards[:,0], tsne_rewards[:,1]
-            tx_rewards = (tx_rewards_orig-np.min(tx_rewards_orig)) / (np.max(tx_rewards_orig) - np.min(tx_rewards_orig))
-            ty_rewards = (ty_rewards_orig-np.min(ty_rewards_orig)) / (np.max(ty_rewards_orig) - np.min(ty_rewards_orig))
-                
-            tx = (tx_orig-np.min(tx_rewards_orig)) / (np.max(tx_rewards_orig) - np.min(tx_rewards_orig))
-            ty = (ty_orig-np.min(ty_rewards_orig)) / (np.max(ty_rewards_orig) - np.min(ty_rewards_orig))
-            for i, coord in enumerate(tsne_rewards):
-                x = tx_rewards[i]
-                y = ty_rewards[i]
-                text = "r: " + str(labels_rewards[i])
-
-                tile = Image.new("RGB", (1000, 1000), (0,0,0))
-                draw = ImageDraw.Draw(tile)
-                font = ImageFont.truetype("Arial.ttf",200)  # load font
-                position = (10, 10)
-                text_color = (255, 255, 255)  # Use RGB values for the desired color
-                draw.text(position, text, font=font, fill=text_color)
-                rs = max(1, tile.width/max_dim, tile.height/max_dim)
-                tile = tile.resize((int(tile.width/rs), int(tile.height/rs)), Image.ANTIALIAS)
-                full_image.paste(tile, (int((width-max_dim)*x), int((height-max_dim)*y)), mask=tile.convert('RGBA'))
-
-        for i, coord in enumerate(tsne_states):
-            x = tx[i]
-            y = ty[i]
-            abstract_state, next_state = values[i]
-            state, action, reward = labels[i]
-
-            color_code = 255 #0 to 255. 
-            if self.params['t-sne_next_state'] == False:
-                phidot, psidot = Shared.get_action_from_index(action, self.params['action_lowest'], self.params['action_highest'], self.params['action_bins'])
-                text = f's:{round(state[0],1),round(state[1],1),round(state[2],1)}\na:{round(phidot, 2), round(psidot,2)}\n'
-            else:
-                text = f's:{round(next_state[0],1),round(next_state[1],1),round(next_state[2],1)}\n '
-                folded_angle = abs(next_state[0])
-                if folded_angle > math.pi/2.0: # x and y axis symmetry
-                    folded_angle = math.pi - folded_angle
-                color_code =  round(255 - 255 * (folded_angle / (math.pi/2.0)))
-
-            tile = Image.new("RGB", (1000, 1000), (color_code,64,64))
-            draw = ImageDraw.Draw(tile)
-            font = ImageFont.truetype("Arial.ttf",130)  # load font
-            position = (10, 10)
-            text_color = (255, 255, 255)  # Use RGB values for the desired color
-            draw.text(position, text, font=font, fill=text_color)
-            rs = max(1, tile.width/max_dim, tile.height/max_dim)
-            tile = tile.resize((int(tile.width/rs), int(tile.height/rs)), Image.ANTIALIAS)
-            full_image.paste(tile, (int((width-max_dim)*x), int((height-max_dim)*y)), mask=tile.convert('RGBA'))
-
-        plt.figure(figsize = (16,16))
-
-        x_ticks = [0, 4000, 8000, 12000, 16000]  # Custom tick positions
-        x_labels = ['0.0', '0.25', '0.5', '0.75', '1.0']  # Custom tick labels for x-axis
-        y_ticks = [0, 4000, 8000, 12000, 16000]  # Custom tick positions
-        y_labels = ['0.0', '0.25', '0.5', '0.75', '1.0']  # Custom tick labels for y-axis
-
-        plt.xticks(x_ticks, x_labels)
-        plt.yticks(y_ticks, y_labels)
-
-        plt.title(f'Equivalent State Mapping on 2-D Euclidean Space After {episode_index+1}\'th episodes ')
-        plt.imshow(full_image)
-        plt.show(block=True)
-        return
-
-    def create_knn_model(self):
-        kNNModel = FaissKNeighbors(self.params['K_for_KNN'])
-        X = torch.stack([tuple[0] for tuple in self.abstract_state_holders.values()]).squeeze(1).cpu().numpy()
-        kNNModel.fit(X, np.array(list(self.abstract_state_holders.keys()), dtype=object))
-        return kNNModel
-
-    def find_equivalences(self, state, action, reward, knn_model):
-        target_key = (tuple(state), action, reward)
-        target_tensor = self.abstract_state_holders[target_key][0]
-        return knn_model.predict(target_tensor[0].cpu().numpy().flatten()[np.newaxis, :])
+            snapshot['reward_fixations'] = self.reward_fixations.table.numpy()
+            snapshot['reward_labels'] = self.reward_fixations.labels()
+
+        if self.params['t-sne_background'] == True:
+            if self.tsne_process is not None:
+                self.tsne_process.join()
+            self.tsne_process = multiprocessing.get_context('spawn').Process(target=Visualization.render_embedding_snapshot, kwargs=snapshot)
+            self.tsne_process.start()
+        else:
+            Visualization.render_embedding_snapshot(**snapshot)
+
+    def find_equivalences(self, states, actions, abstract_rewards, knn_model):
+        """
+        Search the neighbours of every (state, action, abstract_reward) holder in one query.
+        :return: (batch, K) holder slots, -1 where there is no neighbour or the
+        reward filter rejects it
+        """
+        slots = self.abstract_state_holders.get_slots(self.abstract_state_holders.make_keys(states, actions, abstract_rewards))
+        neighbour_slots = knn_model.kneighbors(self.abstract_state_holders.embeddings[slots])
+        if self.params["reward_filter"] == True:
+            rewards_match = self.abstract_state_holders.rewards[neighbour_slots] == abstract_rewards[:, np.newaxis]
+            neighbour_slots = np.where(rewards_match, neighbour_slots, -1)
+        return neighbour_slots
 
     def replay_abstract_model(self):
-        if len(self.abstraction_memory) > self.abstraction_batch_size:
-            minibatch = random.sample(self.abstraction_memory, self.abstraction_batch_size)
-        else:
-            minibatch = self.abstraction_memory
+        self.encode_new_holders()
+        indices = self.abstraction_memory.sample_indices(self.abstraction_batch_size)
+        states_tensor, actions_tensor, rewards_tensor, next_states_tensor = self.abstraction_memory.get(indices)
+        states, actions = self.abstraction_memory.states[indices], self.abstraction_memory.actions[indices]
+        rewards, next_states = self.abstraction_memory.rewards[indices], self.abstraction_memory.next_states[indices]
+        abstract_rewards = self.get_abstract_rewards(rewards)
+        reward_fixations = self.reward_fixations.lookup(abstract_rewards).to(DEVICE)
         self.abstraction_model.train(True)
+        encoded_at = self.abstraction_steps
+        with Profiler.phase('abstraction_update'):
+            abstract_next_states_tensor = self.abstraction_update(states_tensor, actions_tensor, next_states_tensor, reward_fixations)
+        self.abstraction_steps += 1
+
+        with Profiler.phase('holder_write_back'):
+            abstract_next_states = abstract_next_states_tensor.cpu().numpy()
+            keys = self.abstract_state_holders.make_keys(states, actions, abstract_rewards)
+            slots = self.abstract_state_holders.assign_slots(keys, states, actions, abstract_rewards)
+            stored = slots >= 0
+            self.abstract_state_holders.write(slots[stored], abstract_next_states[stored], next_states[stored], encoded_at)
+            self.knn_model.update(slots[stored], abstract_next_states[stored])
+
+        if self.params['holder_refresh'] == 'incremental':
+            with Profiler.phase('holder_refresh'):
+                self.refresh_holders()
+
+    def abstraction_update(self, states_tensor, actions_tensor, next_states_tensor, reward_fixations):
+        """
+        :return: abstract next states encoded before the update
+        """
         self.abstract_optimizer.zero_grad()
-        states, actions, rewards, next_states = zip(*minibatch)
-        states_tensor = torch.tensor(states, dtype=torch.float32).to(DEVICE)
+        loss, abstract_next_states_tensor = self.abstraction_loss(states_tensor, actions_tensor, next_states_tensor, reward_fixations)
+        loss.backward()
+        self.abstract_optimizer.step()
+        return abstract_next_states_tensor.detach()
+
+    def compute_abstraction_loss(self, states_tensor, actions_tensor, next_states_tensor, reward_fixations):
         abstract_states_tensor = self.abstraction_model.state_encoder(states_tensor)
 
-        possible_actions_onehot_tensor = torch.eye(self.params['number_of_actions'])[range(self.params['number_of_actions'])].to(DEVICE)
-        action_embeddings_tensor = self.abstraction_model.action_encoder(abstract_states_tensor, possible_actions_onehot_tensor)
+        action_embeddings_tensor = self.abstraction_model.action_encoder(abstract_states_tensor, self.possible_actions_onehot_tensor)
+
+        transitioned_abstract_states_tensor = abstract_states_tensor + action_embeddings_tensor[torch.arange(action_embeddings_tensor.size(0)), actions_tensor]
 
-        transitioned_abstract_states_tensor = abstract_states_tensor + action_embeddings_tensor[torch.arange(action_embeddings_tensor.size(0)), actions]
-        
-        next_states_tensor = torch.tensor(next_states, dtype=torch.float32).to(DEVICE)
         abstract_next_states_tensor = self.abstraction_model.state_encoder(next_states_tensor)
-        for index, state in enumerate(states):
-            self.abstract_state_holders[(tuple(state), actions[index], self.get_abstract_reward(rewards[index]))] = (abstract_next_states_tensor[index].unsqueeze(0).detach(), next_states[index])
 
         # Loss components
-        abstract_rewards = self.get_abstract_rewards(rewards)
-        reward_fixations = torch.stack([self.reward_fixation_in_abstraction[abstract_reward] for abstract_reward in abstract_rewards])
         trans_loss, equivalence_loss, reward_fixation_loss = self.loss_function(abstract_states_tensor,
                                                             transitioned_abstract_states_tensor, abstract_next_states_tensor,
                                                             action_embeddings_tensor, reward_fixations)
-        loss = trans_loss + equivalence_loss + reward_fixation_loss
-        loss.backward()
-        self.abstract_optimizer.step()
-        
+        return trans_loss + equivalence_loss + reward_fixation_loss, abstract_next_states_tensor
+
     def replay_mem(self, batch_size):
-        self.replay_abstract_model()
-        if len(self.memory) > batch_size:
-            minibatch = random.sample(self.memory, batch_size)
-        else:
-            minibatch = self.memory
-        knn_model = self.create_knn_model()
+        self.encode_new_holders()
+        indices = self.memory.sample_indices(batch_size)
+        states, actions, rewards = self.memory.states[indices], self.memory.actions[indices], self.memory.rewards[indices]
+        rewards_tensor = torch.from_numpy(rewards).to(DEVICE)
+        next_states_tensor = torch.from_numpy(self.memory.next_states[indices]).to(DEVICE)
+
+        with Profiler.phase('find_equivalences'):
+            neighbour_slots = self.find_equivalences(states, actions, self.get_abstract_rewards(rewards), self.knn_model)
+        sample_indices, neighbour_indices = np.nonzero(neighbour_slots >= 0)
+        equivalent_slots = neighbour_slots[sample_indices, neighbour_indices]
+        Profiler.count('equivalent_samples', len(equivalent_slots))
+
+        # the sampled batch followed by its equivalent samples, which take the
+        # targets (and importance weights) of the samples they were found for;
+        # the weights make the summed loss mse(batch) + equivalence_weight * mse(equivalents)
+        combined_states = np.concatenate([states, self.abstract_state_holders.states[equivalent_slots]])
+        combined_actions = np.concatenate([actions, self.abstract_state_holders.actions[equivalent_slots]])
+        target_indices = np.concatenate([np.arange(len(indices)), sample_indices])
+        weights = np.full(len(target_indices), 1.0 / len(indices), dtype=np.float32)
+        if len(equivalent_slots) > 0: # the index may hold no neighbours yet, or the reward filter may drop them all
+            weights[len(indices):] = self.equivalence_weight / len(equivalent_slots)
+        weights *= self.memory.importance_weights(indices)[target_indices]
 
         self.model.train()
         torch.set_grad_enabled(True)
+        self.current_iteration = self.current_iteration + 1
+        sync_target = self.current_iteration % self.target_model_update_iterations == 0
+        with Profiler.phase('q_update'):
+            td_errors = self.q_update(torch.from_numpy(combined_states).to(DEVICE), torch.from_numpy(combined_actions).to(DEVICE),
+                                        rewards_tensor, next_states_tensor, torch.from_numpy(target_indices).to(DEVICE),
+                                        torch.from_numpy(weights).to(DEVICE), sync_target)
+        self.memory.update_priorities(indices, td_errors.cpu().numpy())
+
+    def q_update(self, states_tensor, actions_tensor, rewards_tensor, next_states_tensor, target_indices_tensor, weights_tensor, sync_target):
+        """
+        One forward pass over the sampled and equivalent states.
+        :param target_indices_tensor: row of rewards/next_states whose target each state is fitted to
+        :param weights_tensor: per-state weight of its squared error in the loss
+        :return: TD errors of the sampled (not the equivalent) states
+        """
         self.optimizer.zero_grad()
-        states, actions, rewards, next_states = zip(*minibatch)
-        states_tensor = torch.tensor(states, dtype=torch.float32).to(DEVICE)
-        with torch.no_grad():
-            targets = self.get_targets(rewards, next_states)
-        outputs = self.model.forward(states_tensor)
-        outputs_selected = outputs[torch.arange(len(minibatch)), actions]
-
-        equivalent_states = []
-        equivalent_actions = []
-        equivalent_targets = []
-        for index, (state, action, reward) in enumerate(zip(states, actions, rewards)):
-            abstract_reward = self.get_abstract_reward(reward)
-            equivalences = self.find_equivalences(state, action, abstract_reward, knn_model)
-            for equivalence in equivalences:
-                if self.params["reward_filter"] == True and equivalence[2] != abstract_reward:
-                    continue
-                equivalent_states.append(equivalence[0])
-                equivalent_actions.append(equivalence[1])
-                equivalent_targets.append(targets[index])
-        equivalent_states_tensor = torch.tensor(equivalent_states, dtype=torch.float32).to(DEVICE)
-        equivalent_outputs = self.model.forward(equivalent_states_tensor)
-
-        equivalent_actions_tensor = torch.tensor(equivalent_actions, dtype=torch.int64).to(DEVICE)
-        equivalent_actions_tensor = equivalent_actions_tensor.unsqueeze(-1)
-        equivalent_outputs_selected = equivalent_outputs.gather(1, equivalent_actions_tensor)
-        equivalent_outputs_selected = equivalent_outputs_selected.squeeze(dim=-1)
-        equivalent_targets_tensor = torch.tensor(equivalent_targets).to(DEVICE)
-        equivalence_loss = self.equivalence_weight * F.mse_loss(equivalent_outputs_selected, equivalent_targets_tensor)
-        loss = F.mse_loss(outputs_selected, targets) + equivalence_loss
+        loss, td_errors = self.q_loss(states_tensor, actions_tensor, rewards_tensor, next_states_tensor, target_indices_tensor, weights_tensor)
         loss.backward()
         self.optimizer.step()
- 
-        # epsilon decay
+        if sync_target:
+            self.sync_target_model()
+        return td_errors[:len(rewards_tensor)].detach()
+
+    def compute_q_loss(self, states_tensor, actions_tensor, rewards_tensor, next_states_tensor, target_indices_tensor, weights_tensor):
+        with torch.no_grad():
+            targets = self.get_targets(rewards_tensor, next_states_tensor)
+        outputs = self.model.forward(states_tensor)
+        outputs_selected = outputs.gather(1, actions_tensor.unsqueeze(-1)).squeeze(-1)
+        td_errors = outputs_selected - targets[target_indices_tensor]
+        return (weights_tensor * td_errors.pow(2)).sum(), td_errors
+
+    def sync_target_model(self):
+        with torch.no_grad():
+            for target_parameter, parameter in zip(self.target_model.parameters(), self.model.parameters()):
+                target_parameter.copy_(parameter)
+
+    def decay_epsilon(self):
         self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_minimum)
-        self.current_iteration = self.current_iteration + 1
-        if self.current_iteration % self.target_model_update_iterations == 0:
-            self.target_model.load_state_dict(self.model.state_dict())
 
     def select_action_index(self, state, apply_epsilon_random):
         if apply_epsilon_random == True and random.uniform(0, 1) < self.epsilon:
@@ -374,14 +782,39 @@ class DQNAgent():
             prediction = self.model(state_tensor)
             return np.argmax(prediction.detach().cpu().numpy()[0])
 
-    def get_targets(self, rewards, next_states):
-        rewards_tensor = torch.tensor(rewards, dtype=torch.float32).to(DEVICE)
+    def get_targets(self, rewards_tensor, next_states_tensor):
         with torch.no_grad():
-            next_states_tensor = torch.tensor(next_states, dtype=torch.float32).to(DEVICE)
             q_values_next_states = self.target_model.forward(next_states_tensor)
             max_values, _ = torch.max(q_values_next_states, dim=1)
             targets = rewards_tensor + self.gamma * max_values
         return targets
 
     def on_terminated(self):
-        pass
\ No newline at end of file
+        pass
+
+    def state_dict(self):
+        self.encode_new_holders()
+        return {'model': self.model.state_dict(), 'target_model': self.target_model.state_dict(), 'optimizer': self.optimizer.state_dict(),
+                'abstraction_model': self.abstraction_model.state_dict(), 'abstract_optimizer': self.abstract_optimizer.state_dict(),
+                'memory': self.memory.state_dict(), 'abstraction_memory': self.abstraction_memory.state_dict(),
+                'abstract_state_holders': self.abstract_state_holders.state_dict(),
+                'reward_fixations': self.reward_fixations.state_dict(),
+                'epsilon': self.epsilon, 'current_iteration': self.current_iteration,
+                'abstraction_steps': self.abstraction_steps, 'refresh_cursor': self.refresh_cursor}
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state['model'])
+        self.target_model.load_state_dict(state['target_model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.abstraction_model.load_state_dict(state['abstraction_model'])
+        self.abstract_optimizer.load_state_dict(state['abstract_optimizer'])
+        self.memory.load_state_dict(state['memory'])
+        self.abstraction_memory.load_state_dict(state['abstraction_memory'])
+        self.abstract_state_holders.load_state_dict(state['abstract_state_holders'])
+        self.reward_fixations.load_state_dict(state['reward_fixations'])
+        self.epsilon = state['epsilon']
+        self.current_iteration = state['current_iteration']
+        self.abstraction_steps = state['abstraction_steps']
+        self.refresh_cursor = state['refresh_cursor']
+        holders = self.abstract_state_holders
+        self.knn_model.fit(np.arange(holders.size), holders.embeddings[:holders.size])
@@ -0,0 +1,183 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+import DQN
+import Shared
+import WheelChair
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+class EnsembleLinear(nn.Module):
+    """
+    members independent Linear layers applied with one batched matmul.
+    Inputs and outputs have shape (members, batch, features).
+    """
+    def __init__(self, members, in_features, out_features):
+        super().__init__()
+        self.weight = nn.Parameter(torch.zeros(members, in_features, out_features))
+        self.bias = nn.Parameter(torch.zeros(members, 1, out_features))
+
+    def forward(self, x):
+        return torch.baddbmm(self.bias, x, self.weight)
+
+    def load_member(self, member, linear):
+        with torch.no_grad():
+            self.weight[member].copy_(linear.weight.t())
+            self.bias[member, 0].copy_(linear.bias)
+
+class EnsembleQNetwork(nn.Module):
+    def __init__(self, params, members):
+        super().__init__()
+        self.f1 = EnsembleLinear(members, params['state_size'], params['first_layer_size'])
+        self.f2 = EnsembleLinear(members, params['first_layer_size'], params['second_layer_size'])
+        self.f3 = EnsembleLinear(members, params['second_layer_size'], params['number_of_actions'])
+
+    def forward(self, x):
+        x = F.relu(self.f1(x))
+        x = F.relu(self.f2(x))
+        x = self.f3(x)
+        return x
+
+    def load_member(self, member, q_network):
+        self.f1.load_member(member, q_network.f1)
+        self.f2.load_member(member, q_network.f2)
+        self.f3.load_member(member, q_network.f3)
+
+class EnsembleDQNAgent():
+    """
+    One DQN.DQNAgent per seed, trained together. Networks are stacked along a
+    leading member dimension and the loss is the sum of the per-member losses,
+    so on a given batch every member's gradients (and elementwise Adam
+    updates) match training it alone up to float rounding of the batched
+    matmuls. Each member has its own replay memory, exploration RNG and
+    epsilon. Minibatches and exploration come from that per-member
+    np.random.default_rng(seed), not the global RNG a solo DQN.DQNAgent uses,
+    so a member's reward curve is not the solo curve of the same seed.
+    """
+    def __init__(self, params, seeds):
+        if params['prioritized_replay'] == True:
+            raise ValueError('the ensemble agent only supports uniform replay')
+        self.members = len(seeds)
+        self.gamma = params['gamma']
+        self.number_of_actions = params['number_of_actions']
+        self.epsilon = np.full(self.members, params['epsilon'])
+        self.epsilon_decay = params['epsilon_decay']
+        self.epsilon_minimum = params['epsilon_minimum']
+        self.rngs = [np.random.default_rng(seed) for seed in seeds]
+
+        self.model = EnsembleQNetwork(params, self.members)
+        for member, seed in enumerate(seeds):
+            torch.manual_seed(seed)
+            self.model.load_member(member, DQN.QNetwork(params))
+        self.model.to(DEVICE)
+        self.target_model = EnsembleQNetwork(params, self.members)
+        self.target_model.to(DEVICE)
+        self.target_model.load_state_dict(self.model.state_dict())
+        self.target_model_update_iterations = params['target_model_update_iterations']
+        self.optimizer = optim.Adam(self.model.parameters(), weight_decay=params['weight_decay'], lr=params['learning_rate'])
+        self.current_iteration = 0
+
+        # all members step together, so their ring buffers share one position
+        self.memory_size = params['memory_size']
+        self.states = np.zeros((self.members, self.memory_size, params['state_size']), dtype=np.float32)
+        self.actions = np.zeros((self.members, self.memory_size), dtype=np.int64)
+        self.rewards = np.zeros((self.members, self.memory_size), dtype=np.float32)
+        self.next_states = np.zeros((self.members, self.memory_size, params['state_size']), dtype=np.float32)
+        self.position = 0
+        self.size = 0
+
+    def on_new_samples(self, states, actions, rewards, next_states):
+        """
+        Store one transition per member; every argument has a leading member dimension.
+        """
+        self.states[:, self.position] = states
+        self.actions[:, self.position] = actions
+        self.rewards[:, self.position] = rewards
+        self.next_states[:, self.position] = next_states
+        self.position = (self.position + 1) % self.memory_size
+        self.size = min(self.size + 1, self.memory_size)
+
+    def sample_indices(self, batch_size):
+        if self.size > batch_size:
+            return np.stack([rng.choice(self.size, batch_size, replace=False) for rng in self.rngs])
+        return np.broadcast_to(np.arange(self.size), (self.members, self.size))
+
+    def replay_mem(self, batch_size):
+        indices = self.sample_indices(batch_size)
+        members = np.arange(self.members)[:, np.newaxis]
+        states_tensor = torch.from_numpy(self.states[members, indices]).to(DEVICE)
+        actions_tensor = torch.from_numpy(self.actions[members, indices]).to(DEVICE)
+        rewards_tensor = torch.from_numpy(self.rewards[members, indices]).to(DEVICE)
+        next_states_tensor = torch.from_numpy(self.next_states[members, indices]).to(DEVICE)
+
+        self.model.train()
+        torch.set_grad_enabled(True)
+        self.optimizer.zero_grad()
+        with torch.no_grad():
+            max_values, _ = torch.max(self.target_model.forward(next_states_tensor), dim=2)
+            targets = rewards_tensor + self.gamma * max_values
+        outputs = self.model.forward(states_tensor)
+        outputs_selected = outputs.gather(2, actions_tensor.unsqueeze(-1)).squeeze(-1)
+        loss = (outputs_selected - targets).pow(2).mean(dim=1).sum()
+        loss.backward()
+        self.optimizer.step()
+
+        self.current_iteration = self.current_iteration + 1
+        if self.current_iteration % self.target_model_update_iterations == 0:
+            self.target_model.load_state_dict(self.model.state_dict())
+
+    def replay_abstract_model(self):
+        pass
+
+    def decay_epsilon(self):
+        self.epsilon = np.maximum(self.epsilon * self.epsilon_decay, self.epsilon_minimum)
+
+    def select_action_indices(self, states, apply_epsilon_random):
+        with torch.no_grad():
+            states_tensor = torch.from_numpy(np.asarray(states, dtype=np.float32)[:, np.newaxis, :]).to(DEVICE)
+            action_indices = self.model(states_tensor)[:, 0].argmax(dim=1).cpu().numpy()
+        if apply_epsilon_random == True:
+            for member, rng in enumerate(self.rngs):
+                if rng.uniform(0, 1) < self.epsilon[member]:
+                    action_indices[member] = rng.integers(self.number_of_actions)
+        return action_indices
+
+def train_ensemble_and_sample_performance(agent, params):
+    """
+    Ensemble counterpart of Shared.train_agent_and_sample_performance.
+    :return: (members, episodes) array of total rewards
+    """
+    rewards_for_each_episode = np.zeros((agent.members, params['episodes']))
+    scheduler = Shared.TrainingScheduler(params)
+    for i in range(params['episodes']):
+        if i % 10 == 0:
+            print(f'ensemble of {agent.members}, epidoes: {i}')
+        theta, phi, psi = np.array([rng.uniform(-3.14, 3.14, 3) for rng in agent.rngs]).T
+        robots = WheelChair.VectorWheelChair(agent.members, t_interval=1.0, theta=theta, phi=phi, psi=psi, integration=params['integration'],
+                                             action_lowest=params['action_lowest'], action_highest=params['action_highest'], action_bins=params['action_bins'])
+        current_states = robots.state
+        for j in range(params['episode_length']):
+            actions = agent.select_action_indices(current_states, True)
+            new_states, rewards = robots.step(actions)
+            rewards_for_each_episode[:, i] += rewards
+            agent.on_new_samples(current_states, actions, rewards, new_states)
+            scheduler.on_env_step(agent)
+            current_states = new_states
+    return rewards_for_each_episode
+
+def run_ensemble(params, save_file_path):
+    """
+    Ensemble counterpart of Shared.run for DQN.DQNAgent: trains the seeds in
+    groups of params['ensemble_size'] and saves one reward curve per seed.
+    """
+    first_seed = Shared.get_new_result_index(save_file_path) + 5
+    seeds = list(range(first_seed, first_seed + params['run_times_for_performance_average']))
+    rewards = []
+    for start in range(0, len(seeds), params['ensemble_size']):
+        group = seeds[start:start + params['ensemble_size']]
+        agent = EnsembleDQNAgent(params, group)
+        rewards = train_ensemble_and_sample_performance(agent, params)
+        for seed, member_rewards in zip(group, rewards):
+            Shared.save_result(save_file_path, member_rewards.tolist(), seed, params)
+    return rewards
@@ -0,0 +1,98 @@
+"""
+Named timers and counters around the hot phases of a run.
+
+    with Profiler.phase('env_step'):
+        robot.move(action)
+    Profiler.count('env_steps')
+
+Profiling is off until configure() is given an output path; while off,
+phase() returns a shared no-op context manager and count() returns at once.
+end_episode() appends the per-episode aggregates as one JSON line, and
+write_trace() saves every phase timed since configure() as a Chrome trace
+(chrome://tracing, Perfetto). configure() is called once per run and starts
+a new trace, so a sweep worker only holds the events of its current run.
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+
+enabled = False
+jsonl_path = None
+trace_path = None
+phase_calls = {}
+phase_seconds = {}
+counters = {}
+trace_events = []
+null_phase = contextlib.nullcontext()
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter_ns() - self.start
+        phase_calls[self.name] = phase_calls.get(self.name, 0) + 1
+        phase_seconds[self.name] = phase_seconds.get(self.name, 0.0) + elapsed * 1e-9
+        if trace_path is not None:
+            trace_events.append((self.name, self.start, elapsed, threading.get_ident()))
+
+def configure(path=None, chrome_trace_path=None):
+    """
+    :param path: JSONL file the per-episode aggregates are appended to
+    :param chrome_trace_path: Chrome trace output, may contain {pid} and {run}
+    so that sweep workers and the runs of a worker write separate files
+    """
+    global enabled, jsonl_path, trace_path
+    jsonl_path = path
+    trace_path = chrome_trace_path
+    enabled = jsonl_path is not None or trace_path is not None
+    phase_calls.clear()
+    phase_seconds.clear()
+    counters.clear()
+    trace_events.clear()
+
+def phase(name):
+    if not enabled:
+        return null_phase
+    return Phase(name)
+
+def count(name, value=1):
+    if not enabled:
+        return
+    counters[name] = counters.get(name, 0) + value
+
+def end_episode(**labels):
+    """
+    Append the aggregates collected since the previous call, tagged with labels
+    (e.g. run and episode), and reset them.
+    """
+    if not enabled:
+        return
+    if jsonl_path is not None:
+        record = dict(labels, pid=os.getpid(),
+                      phases={name: {'calls': phase_calls[name], 'seconds': phase_seconds[name]} for name in phase_calls},
+                      counters=dict(counters))
+        with open(jsonl_path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+    phase_calls.clear()
+    phase_seconds.clear()
+    counters.clear()
+
+def write_trace(run=None):
+    """
+    Save the events of the current run and drop them.
+    """
+    if trace_path is None:
+        return
+    pid = os.getpid()
+    events = [{'name': name, 'ph': 'X', 'ts': start / 1000, 'dur': elapsed / 1000, 'pid': pid, 'tid': tid}
+              for name, start, elapsed, tid in trace_events]
+    with open(trace_path.format(pid=pid, run=run), 'w') as file:
+        json.dump({'traceEvents': events}, file)
+    trace_events.clear()
@@ -0,0 +1,176 @@
+import numpy as np
+import torch
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+class ReplayMemory():
+    """
+    Fixed-capacity ring buffer of <state, action, reward, next_state>
+    transitions stored in preallocated NumPy arrays.
+    """
+    def __init__(self, capacity, state_size):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state):
+        self.states[self.position] = state
+        self.actions[self.position] = action
+        self.rewards[self.position] = reward
+        self.next_states[self.position] = next_state
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample_indices(self, batch_size):
+        """
+        Indices of a minibatch drawn without replacement, or of the whole
+        memory if it does not hold more than batch_size transitions. Duplicate
+        draws are redrawn, which keeps every subset equally likely without the
+        O(size) permutation np.random.choice(replace=False) does, unless the
+        memory is small enough for the permutation to be the cheaper option.
+        """
+        if self.size > batch_size and self.size < 4 * batch_size:
+            return np.random.permutation(self.size)[:batch_size]
+        if self.size > batch_size:
+            indices = np.unique(np.random.randint(0, self.size, batch_size))
+            while len(indices) < batch_size:
+                indices = np.unique(np.concatenate([indices, np.random.randint(0, self.size, batch_size - len(indices))]))
+            return indices.astype(np.int64)
+        return np.arange(self.size, dtype=np.int64)
+
+    def get(self, indices):
+        """
+        :return: states, actions, rewards and next_states tensors for the given indices
+        """
+        return (torch.from_numpy(self.states[indices]).to(DEVICE),
+                torch.from_numpy(self.actions[indices]).to(DEVICE),
+                torch.from_numpy(self.rewards[indices]).to(DEVICE),
+                torch.from_numpy(self.next_states[indices]).to(DEVICE))
+
+    def sample(self, batch_size):
+        return self.get(self.sample_indices(batch_size))
+
+    def importance_weights(self, indices):
+        return np.ones(len(indices), dtype=np.float32)
+
+    def update_priorities(self, indices, td_errors):
+        pass
+
+    def state_dict(self):
+        return {'states': self.states, 'actions': self.actions, 'rewards': self.rewards, 'next_states': self.next_states,
+                'position': self.position, 'size': self.size}
+
+    def load_state_dict(self, state):
+        """
+        Adopts the arrays of state as they are (e.g. memory-mapped) instead of copying them.
+        """
+        self.states = state['states']
+        self.actions = state['actions']
+        self.rewards = state['rewards']
+        self.next_states = state['next_states']
+        self.capacity = len(self.states)
+        self.position = state['position']
+        self.size = state['size']
+
+
+class SumTree():
+    """
+    Binary tree over capacity leaves (rounded up to a power of two) whose
+    inner nodes hold the sum of their children, stored in one array with the
+    root at index 1. Updates and prefix-sum searches walk the log2(capacity)
+    levels once, vectorized over the batch.
+    """
+    def __init__(self, capacity):
+        self.leaves = 1 << max(0, (capacity - 1).bit_length())
+        self.depth = self.leaves.bit_length() - 1
+        self.nodes = np.zeros(2 * self.leaves)
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indices):
+        return self.nodes[np.asarray(indices) + self.leaves]
+
+    def update(self, indices, values):
+        nodes = np.asarray(indices, dtype=np.int64) + self.leaves
+        self.nodes[nodes] = values
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, prefix_sums):
+        """
+        :return: for every prefix sum, the leaf whose interval of the running sum contains it
+        """
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            # never step into an empty subtree, even when rounding overshoots the total
+            go_right = (prefix_sums >= self.nodes[left]) & (self.nodes[left + 1] > 0)
+            prefix_sums = np.where(go_right, prefix_sums - self.nodes[left], prefix_sums)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.leaves
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    Proportional prioritized replay (Schaul et al., 2016). Transitions are
+    sampled with probability p_i / sum(p), p_i = (|td_error_i| + epsilon)^alpha,
+    from a SumTree; new transitions get the highest priority seen so far.
+    importance_weights corrects the sampling bias with beta annealed from
+    beta to 1 over beta_steps sampled batches.
+    """
+    def __init__(self, capacity, state_size, alpha, beta, beta_steps, epsilon=1e-6):
+        super().__init__(capacity, state_size)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.sampled_batches = 0
+
+    def append(self, state, action, reward, next_state):
+        self.tree.update([self.position], [self.max_priority])
+        super().append(state, action, reward, next_state)
+
+    def sample_indices(self, batch_size):
+        """
+        Stratified: one index from each of batch_size equal slices of the total priority.
+        """
+        self.sampled_batches += 1
+        if self.size <= batch_size:
+            return np.arange(self.size, dtype=np.int64)
+        segment = self.tree.total() / batch_size
+        return self.tree.find((np.arange(batch_size) + np.random.random(batch_size)) * segment)
+
+    def importance_weights(self, indices):
+        beta = min(1.0, self.beta + (1.0 - self.beta) * self.sampled_batches / self.beta_steps)
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (self.size * probabilities) ** -beta
+        return (weights / weights.max()).astype(np.float32)
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def state_dict(self):
+        return dict(super().state_dict(), tree=self.tree.nodes, max_priority=self.max_priority, sampled_batches=self.sampled_batches)
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.tree.nodes = state['tree']
+        self.max_priority = state['max_priority']
+        self.sampled_batches = state['sampled_batches']
+
+def make_replay_memory(params, capacity):
+    if params['prioritized_replay'] == True:
+        return PrioritizedReplayMemory(capacity, params['state_size'], params['priority_alpha'], params['priority_beta'], params['priority_beta_steps'])
+    return ReplayMemory(capacity, params['state_size'])
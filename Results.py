@@ -0,0 +1,177 @@
+"""
+Columnar result store. Every configuration directory holds
+	rewards.bin  - float64 reward curves, one row of `episodes` values per run
+	runs.jsonl   - one line of metadata (index, seed, params, RunCache key) per run
+	meta.json    - the row length (`episodes`) shared by all runs
+	stale.jsonl  - runs taken out by remove_runs, one JSON line each with their rewards
+Appends take an exclusive lock on the directory so concurrent writers never
+clobber each other, and load_rewards reads all runs with a single read.
+Directories written by older versions hold one N.csv file per run instead.
+They are read as they are and moved into the store by the first append.
+"""
+import os
+import csv
+import json
+import fcntl
+import numpy as np
+
+REWARDS_FILE = 'rewards.bin'
+RUNS_FILE = 'runs.jsonl'
+META_FILE = 'meta.json'
+STALE_FILE = 'stale.jsonl'
+LOCK_FILE = '.lock'
+
+class DirectoryLock:
+	def __init__(self, path):
+		self.path = path
+
+	def __enter__(self):
+		os.makedirs(self.path, exist_ok=True)
+		self.file = open(os.path.join(self.path, LOCK_FILE), 'w')
+		fcntl.flock(self.file, fcntl.LOCK_EX)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		fcntl.flock(self.file, fcntl.LOCK_UN)
+		self.file.close()
+
+def read_episodes(path):
+	meta_path = os.path.join(path, META_FILE)
+	if not os.path.exists(meta_path):
+		return None
+	with open(meta_path, 'r') as file:
+		return json.load(file)['episodes']
+
+def count_csv_runs(path):
+	count = 0
+	while os.path.exists(os.path.join(path, f'{count}.csv')):
+		count += 1
+	return count
+
+def load_runs(path):
+	"""
+	:return: metadata dicts of the stored runs, in append order
+	"""
+	runs_path = os.path.join(path, RUNS_FILE)
+	if not os.path.exists(runs_path):
+		# N.csv was run with seed N + 5
+		return [{'index': index, 'seed': index + 5, 'params': None} for index in range(count_csv_runs(path))]
+	with open(runs_path, 'r') as file:
+		return [json.loads(line) for line in file if line.endswith('\n')]
+
+def count_runs(path):
+	return len(load_runs(path))
+
+def append_run(path, rewards, seed=None, params=None, key=None):
+	"""
+	Atomically append one run to the store at path.
+	:param key: RunCache.run_key of the run, if known
+	:return: index of the appended run
+	"""
+	rewards = np.asarray(rewards, dtype=np.float64)
+	with DirectoryLock(path):
+		episodes = read_episodes(path)
+		if episodes is None:
+			episodes = migrate_csv_runs(path)
+		if episodes is None:
+			episodes = len(rewards)
+			with open(os.path.join(path, META_FILE), 'w') as file:
+				json.dump({'episodes': episodes}, file)
+		if len(rewards) != episodes:
+			raise ValueError(f'{path} stores runs of {episodes} episodes, got {len(rewards)}')
+
+		index = count_runs(path)
+		with open(os.path.join(path, REWARDS_FILE), 'ab') as file:
+			# drop the tail of a run whose metadata was never written
+			file.truncate(index * episodes * rewards.itemsize)
+			file.write(rewards.tobytes())
+			file.flush()
+			os.fsync(file.fileno())
+		with open(os.path.join(path, RUNS_FILE), 'ab+') as file:
+			# drop a torn last line, so the new run does not continue it
+			file.seek(0)
+			file.truncate(file.read().rfind(b'\n') + 1)
+			run = {'index': index, 'seed': seed, 'params': params}
+			if key is not None:
+				run['key'] = key
+			file.write((json.dumps(run, default=str) + '\n').encode())
+	return index
+
+def remove_runs(path, keep):
+	"""
+	Take every run for which keep(run) is false out of the store and append
+	it to stale.jsonl. The remaining runs are renumbered in order, and a store
+	left empty forgets its row length.
+	:return: number of removed runs
+	"""
+	if len(load_runs(path)) == 0:
+		return 0
+	with DirectoryLock(path):
+		if read_episodes(path) is None:
+			migrate_csv_runs(path)
+		runs = load_runs(path)
+		rewards = load_rewards(path)
+		kept = [index for index, run in enumerate(runs) if keep(run)]
+		if len(kept) == len(runs):
+			return 0
+		kept_indices = set(kept)
+		with open(os.path.join(path, STALE_FILE), 'a') as file:
+			for index, run in enumerate(runs):
+				if index not in kept_indices:
+					file.write(json.dumps(dict(run, rewards=rewards[index].tolist()), default=str) + '\n')
+		if len(kept) == 0:
+			for name in [RUNS_FILE, REWARDS_FILE, META_FILE]:
+				os.remove(os.path.join(path, name))
+			return len(runs)
+		# rewards first: a crash before runs.jsonl is replaced leaves a readable prefix
+		temporary_path = os.path.join(path, REWARDS_FILE + '.tmp')
+		rewards[kept].tofile(temporary_path)
+		os.replace(temporary_path, os.path.join(path, REWARDS_FILE))
+		temporary_path = os.path.join(path, RUNS_FILE + '.tmp')
+		with open(temporary_path, 'w') as file:
+			for new_index, index in enumerate(kept):
+				file.write(json.dumps(dict(runs[index], index=new_index), default=str) + '\n')
+		os.replace(temporary_path, os.path.join(path, RUNS_FILE))
+	return len(runs) - len(kept)
+
+def migrate_csv_runs(path):
+	"""
+	Move the N.csv runs of path into a new store, called with the directory
+	locked. The CSV files are left in place.
+	:return: episodes of the migrated runs, or None if there were none
+	"""
+	rewards = load_csv_rewards(path)
+	if len(rewards) == 0:
+		return None
+	runs = load_runs(path)
+	with open(os.path.join(path, REWARDS_FILE), 'wb') as file:
+		file.write(rewards.tobytes())
+		file.flush()
+		os.fsync(file.fileno())
+	with open(os.path.join(path, RUNS_FILE), 'w') as file:
+		for run in runs:
+			file.write(json.dumps(dict(run, migrated_from=f"{run['index']}.csv")) + '\n')
+	with open(os.path.join(path, META_FILE), 'w') as file:
+		json.dump({'episodes': rewards.shape[1]}, file)
+	return rewards.shape[1]
+
+def load_csv_rewards(path):
+	"""
+	Reward curves saved as one N.csv file per run, before this store existed.
+	"""
+	rewards = []
+	while os.path.exists(os.path.join(path, f'{len(rewards)}.csv')):
+		with open(os.path.join(path, f'{len(rewards)}.csv'), 'r') as file:
+			rewards.append(next(csv.reader(file)))
+	return np.array(rewards, dtype=np.float64)
+
+def load_rewards(path):
+	"""
+	:return: (runs, episodes) array of every stored reward curve
+	"""
+	episodes = read_episodes(path)
+	if episodes is None:
+		return load_csv_rewards(path)
+	runs = count_runs(path)
+	rewards = np.fromfile(os.path.join(path, REWARDS_FILE), dtype=np.float64, count=runs * episodes)
+	return rewards.reshape(runs, episodes)
@@ -0,0 +1,109 @@
+"""
+Content-addressed cache of finished runs. A run is identified by
+	run_key = sha256(params, agent class, code version, seed)
+and stored as <cache path>/<key[:2]>/<key>.json holding its reward curve, so
+a sweep can reuse any (configuration, seed) cell that was already computed,
+whatever result directory it was saved to. Params that only control how a
+run is executed or logged (IGNORED_PARAMS) are left out of the key. The code
+version hashes every repository module a run imports, found by following
+the import statements from Shared, Sweep (which decides the seeding order)
+and the agent's module, together with the library versions. Modules are
+hashed as their syntax tree without docstrings, so comment, docstring and
+formatting edits keep the cache while any other source edit invalidates it.
+"""
+import os
+import sys
+import ast
+import json
+import hashlib
+import functools
+import numpy as np
+import torch
+
+IGNORED_PARAMS = {'run_times_for_performance_average', 'workers', 'threads_per_worker', 'cpu_affinity',
+				  'profile_path', 'profile_trace_path', 'checkpoint_interval', 'resume', 'run_cache_path',
+				  't-sne_output_path', 't-sne_max_points', 't-sne_max_labels', 't-sne_background',
+				  'sweep_scheduler', 'halving_eta', 'halving_min_episodes', 'halving_min_seeds', 'halving_metric_fraction', 'halving_log_path'}
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def library_versions():
+	import faiss
+	return {'python': sys.version.split()[0], 'numpy': np.__version__, 'torch': torch.__version__, 'faiss': faiss.__version__}
+
+def parse_module(module):
+	with open(os.path.join(SOURCE_DIRECTORY, f'{module}.py'), 'r') as file:
+		return ast.parse(file.read())
+
+def strip_docstrings(tree):
+	for node in ast.walk(tree):
+		if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body and \
+				isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant) and isinstance(node.body[0].value.value, str):
+			node.body = node.body[1:] or [ast.Pass()]
+	return tree
+
+def imported_modules(tree):
+	"""
+	Repository modules imported anywhere in tree, including inside functions.
+	"""
+	names = set()
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Import):
+			names.update(alias.name.split('.')[0] for alias in node.names)
+		elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+			names.add(node.module.split('.')[0])
+	return {name for name in names if os.path.exists(os.path.join(SOURCE_DIRECTORY, f'{name}.py'))}
+
+@functools.lru_cache(maxsize=None)
+def code_version(root_modules):
+	trees = {}
+	pending = set(root_modules)
+	while pending:
+		module = pending.pop()
+		trees[module] = parse_module(module)
+		pending |= imported_modules(trees[module]) - trees.keys()
+	digest = hashlib.sha256()
+	for module in sorted(trees):
+		digest.update(module.encode())
+		digest.update(ast.dump(strip_docstrings(trees[module])).encode())
+	digest.update(json.dumps(library_versions(), sort_keys=True).encode())
+	return digest.hexdigest()
+
+def agent_name(agent_type):
+	return f'{agent_type.__module__}.{agent_type.__qualname__}'
+
+def run_key(params, agent_type, seed):
+	identity = {'params': {key: value for key, value in params.items() if key not in IGNORED_PARAMS},
+				'agent': agent_name(agent_type), 'code': code_version(tuple(sorted({'Shared', 'Sweep', agent_type.__module__}))), 'seed': seed}
+	return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()
+
+def cacheable(params):
+	# async actors act on whichever weights were published last and interleave by timing, so those runs are not reproducible;
+	# ensemble runs (Ensemble.run_ensemble) are saved without going through the cache
+	return params['run_cache_path'] is not None and params['async_actors'] == 0 and params['ensemble_size'] == 1
+
+def entry_path(path, key):
+	return os.path.join(path, key[:2], f'{key}.json')
+
+def load(params, key):
+	"""
+	:return: the cached reward curve of the run with key, or None
+	"""
+	if not cacheable(params) or not os.path.exists(entry_path(params['run_cache_path'], key)):
+		return None
+	with open(entry_path(params['run_cache_path'], key), 'r') as file:
+		return json.load(file)['rewards']
+
+def store(params, key, rewards, seed, agent_type):
+	"""
+	Atomically write the reward curve of a finished run.
+	"""
+	if not cacheable(params):
+		return
+	final_path = entry_path(params['run_cache_path'], key)
+	os.makedirs(os.path.dirname(final_path), exist_ok=True)
+	temporary_path = f'{final_path}.{os.getpid()}.tmp'
+	with open(temporary_path, 'w') as file:
+		json.dump({'key': key, 'seed': seed, 'agent': agent_name(agent_type), 'rewards': [float(reward) for reward in rewards]}, file)
+		file.flush()
+		os.fsync(file.fileno())
+	os.replace(temporary_path, final_path)
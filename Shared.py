@@ -1,12 +1,12 @@
+import os
 import numpy as np
 import torch
 import random
-import csv
-import os
-import matplotlib as mpl
 import WheelChair
-
-mpl.use('TkAgg')
+import Results
+import Profiler
+import Checkpoint
+import RunCache
 
 def parameters():
 	params = dict()
@@ -22,7 +22,28 @@ def parameters():
 	params['epsilon'] = 1.0
 	params['epsilon_decay'] = 0.995
 	params['epsilon_minimum'] = 0.1
-	params['target_model_update_iterations'] = round(params['episode_length'] / 2)
+	params['target_model_update_iterations'] = round(params['episode_length'] / 2) # counted in gradient steps
+
+	# proportional prioritized replay of the Q memory (ReplayMemory.PrioritizedReplayMemory)
+	params['prioritized_replay'] = False
+	params['priority_alpha'] = 0.6
+	params['priority_beta'] = 0.4 # importance-sampling exponent, annealed to 1
+	params['priority_beta_steps'] = params['episodes'] * params['episode_length'] # sampled batches over which beta reaches 1
+
+	# update-to-data schedule (TrainingScheduler): every *_frequency environment steps run *_gradient_steps updates
+	params['train_frequency'] = 1
+	params['gradient_steps'] = 1
+	params['abstraction_train_frequency'] = 1 # equivalent agent only
+	params['abstraction_gradient_steps'] = 1 # equivalent agent only
+
+	# compile the Q (and abstraction) losses with torch.compile, checked against eager on the first calls.
+	# On CPU with these small networks it is no faster (abstraction updates are slower), see benchmark.py --compile
+	params['compile_training_step'] = False
+
+	# per-phase timings (Profiler): per-episode JSONL aggregates and/or a Chrome trace per run
+	# ({pid} and {run} are replaced by the process id and run number; without {run} each run overwrites the last)
+	params['profile_path'] = None
+	params['profile_trace_path'] = None
 
 	params['first_layer_size'] = 256    # neurons in the first layer
 	params['second_layer_size'] = 256   # neurons in the second layer
@@ -32,35 +53,113 @@ def parameters():
 	params['action_lowest'] = -1.0
 	params['action_highest'] = 1.0
 	params['number_of_actions'] = params['action_bins'] ** 2
+	params['integration'] = 'analytic' # 'analytic' (closed form) or 'odeint' (reference)
+
+	# sweep runner (Sweep.run_sweep)
+	params['workers'] = None # defaults to available cpus // threads_per_worker
+	params['threads_per_worker'] = 1
+	params['cpu_affinity'] = True
+
+	# >1 trains that many seeds of DQN.DQNAgent together (Ensemble.run_ensemble)
+	params['ensemble_size'] = 1
+
+	# save the full agent state every checkpoint_interval episodes (0 disables) under <result path>/checkpoints/
+	params['checkpoint_interval'] = 0
+	# True: run seeds 5..run_times_for_performance_average+4, skipping stored ones and continuing from checkpoints
+	# False: append run_times_for_performance_average new seeds after the stored runs
+	params['resume'] = False
+	# a directory such as 'result/run_cache' caches finished runs by RunCache.run_key for later sweeps, None disables.
+	# While enabled, seeds 5..run_times_for_performance_average+4 are run as with resume, and stored runs made
+	# with other params or code are moved to stale.jsonl in the result directory and run again.
+	params['run_cache_path'] = None
+
+	# >0 steps the robots in that many actor processes while this process learns (AsyncTraining)
+	params['async_actors'] = 0
+	params['async_weight_sync_interval'] = 4 # gradient steps between weight publications to the actors
+	params['async_max_pending'] = 32 # transitions actors may run ahead of the learner
+	params['async_max_update_ratio'] = 1.0 # >1 lets the learner train while waiting, up to this multiple of the scheduled gradient steps
 	return params
 
 def get_new_result_index(path):
-	if not os.path.exists(path):
-		os.makedirs(path)
-	index = 0
-	file_name = f"{index}.csv"
-	file_path = os.path.join(path, file_name)
-	while os.path.exists(file_path):
-		index += 1
-		file_name = f"{index}.csv"
-		file_path = os.path.join(path, file_name)
-	return index
-
-def save_result(path, reward):
-	index = get_new_result_index(path)
-	file_name = f"{index}.csv"
-	file_path = os.path.join(path, file_name)
-	with open(file_path, mode='w', newline='') as file:
-		writer = csv.writer(file)
-		writer.writerow(reward)
+	return Results.count_runs(path)
+
+def save_result(path, reward, seed=None, params=None, key=None):
+	return Results.append_run(path, reward, seed, params, key)
+
+def record_result(params, agent_type, save_file_path, seed, rewards):
+	"""
+	Save a finished run to save_file_path and to the run cache.
+	"""
+	key = RunCache.run_key(params, agent_type, seed)
+	RunCache.store(params, key, rewards, seed, agent_type)
+	return save_result(save_file_path, rewards, seed, params, key)
+
+def get_completed_seeds(params, save_file_path, agent_type):
+	"""
+	With the run cache enabled, stored runs whose key does not match the current
+	params and code (and repeated seeds) are first removed from save_file_path,
+	so they are neither counted nor plotted.
+	"""
+	if params['run_cache_path'] is not None:
+		seen_seeds = set()
+		def is_current(run):
+			current = run['seed'] not in seen_seeds and run.get('key') == RunCache.run_key(params, agent_type, run['seed'])
+			if current:
+				seen_seeds.add(run['seed'])
+			return current
+		removed = Results.remove_runs(save_file_path, is_current)
+		if removed > 0:
+			print(f'{save_file_path}: moved {removed} stale runs to {Results.STALE_FILE}')
+	return {run['seed'] for run in Results.load_runs(save_file_path)}
+
+def get_pending_seeds(params, save_file_path, agent_type):
+	"""
+	Seeds still to be run for save_file_path, see params['resume'] and params['run_cache_path'].
+	"""
+	if params['resume'] == True or params['run_cache_path'] is not None:
+		completed = get_completed_seeds(params, save_file_path, agent_type)
+		for seed in completed:
+			Checkpoint.remove(get_checkpoint_path(save_file_path, seed))
+		return [seed for seed in range(5, params['run_times_for_performance_average'] + 5) if seed not in completed]
+	first_seed = get_new_result_index(save_file_path) + 5
+	return list(range(first_seed, first_seed + params['run_times_for_performance_average']))
+
+def get_checkpoint_path(save_file_path, seed):
+	return os.path.join(save_file_path, 'checkpoints', f'seed_{seed}')
+
+def remove_checkpoints(save_file_path, seeds):
+	"""
+	Remove the checkpoints of seeds, and the checkpoints directory once it is empty.
+	"""
+	for seed in seeds:
+		Checkpoint.remove(get_checkpoint_path(save_file_path, seed))
+	try:
+		os.rmdir(os.path.join(save_file_path, 'checkpoints'))
+	except OSError:
+		pass
+
+def prepare_checkpoint(params, save_file_path, seed):
+	"""
+	:return: checkpoint path of the seed, or None if checkpointing is off.
+	Without params['resume'] a leftover checkpoint is discarded.
+	"""
+	if params['checkpoint_interval'] == 0:
+		return None
+	path = get_checkpoint_path(save_file_path, seed)
+	if params['resume'] != True:
+		Checkpoint.remove(path)
+	return path
 
 def run(params, agent_type, save_file_path):
 	rewards = []
-	for i in range(params['run_times_for_performance_average']):
+	for i, seed in enumerate(get_pending_seeds(params, save_file_path, agent_type)):
+		set_seed(seed)
 		agent = agent_type(params)
-		set_seed(get_new_result_index(save_file_path)+5)
-		rewards = train_agent_and_sample_performance(agent, params, i)
-		save_result(save_file_path, rewards)
+		checkpoint_path = prepare_checkpoint(params, save_file_path, seed)
+		rewards = train_agent_and_sample_performance(agent, params, i, checkpoint_path)
+		record_result(params, agent_type, save_file_path, seed, rewards)
+		if checkpoint_path is not None:
+			Checkpoint.remove(checkpoint_path)
 	return rewards
 
 def get_val_from_index(ind, low, high, n_bins):
@@ -77,30 +176,93 @@ def get_action_from_index(action_index, action_lowest, action_highest, action_bi
 
 	return phidot_true, psidot_true
 
-def train_agent_and_sample_performance(agent, params, run_iteration):
+class TrainingScheduler():
+	"""
+	Decides when an agent trains. Update frequencies and epsilon decay run on
+	the environment-step clock; target network syncs are counted by the agent
+	in gradient steps.
+	"""
+	def __init__(self, params):
+		self.batch_size = params['batch_size']
+		self.train_frequency = params['train_frequency']
+		self.gradient_steps = params['gradient_steps']
+		self.abstraction_train_frequency = params['abstraction_train_frequency']
+		self.abstraction_gradient_steps = params['abstraction_gradient_steps']
+		self.env_steps = 0
+
+	def scheduled_gradient_steps(self):
+		return self.env_steps // self.train_frequency * self.gradient_steps
+
+	def on_env_step(self, agent):
+		self.env_steps += 1
+		if self.env_steps % self.abstraction_train_frequency == 0:
+			for _ in range(self.abstraction_gradient_steps):
+				with Profiler.phase('replay_abstract_model'):
+					agent.replay_abstract_model()
+		if self.env_steps % self.train_frequency == 0:
+			for _ in range(self.gradient_steps):
+				with Profiler.phase('replay_mem'):
+					agent.replay_mem(self.batch_size)
+				Profiler.count('gradient_steps')
+		agent.decay_epsilon()
+
+def train_agent_and_sample_performance(agent, params, run_iteration, checkpoint_path=None, stop_episode=None):
+	"""
+	:param checkpoint_path: if given, training continues from the checkpoint
+	stored there (if any) and saves one every params['checkpoint_interval'] episodes
+	:param stop_episode: stop after this many of params['episodes'] episodes,
+	saving a checkpoint there to continue from later
+	"""
+	if params['async_actors'] > 0:
+		if checkpoint_path is not None:
+			raise ValueError('checkpoints are not supported with async actors')
+		import AsyncTraining # imports Shared
+		return AsyncTraining.train_agent_and_sample_performance(agent, params, run_iteration)
 	rewards_for_each_episode = []
-	for i in range(params['episodes']):
-		agent.on_episode_start(i)
+	scheduler = TrainingScheduler(params)
+	Profiler.configure(params['profile_path'], params['profile_trace_path'])
+	checkpoint = Checkpoint.load(checkpoint_path) if checkpoint_path is not None else None
+	if checkpoint is not None:
+		agent.load_state_dict(checkpoint['agent'])
+		scheduler.env_steps = checkpoint['env_steps']
+		rewards_for_each_episode = checkpoint['rewards']
+		Checkpoint.set_rng_state(checkpoint['rng'])
+		print(f'{run_iteration}th running, resumed after {len(rewards_for_each_episode)} episodes')
+	stop_episode = params['episodes'] if stop_episode is None else stop_episode
+	for i in range(len(rewards_for_each_episode), stop_episode):
+		with Profiler.phase('on_episode_start'):
+			agent.on_episode_start(i)
 		if i % 10 == 0:
 			print(f'{run_iteration}th running, epidoes: {i}')
-		robot = WheelChair.WheelChairRobot(t_interval = 1.0,theta=random.uniform(-3.14, 3.14), phi=random.uniform(-3.14, 3.14), psi=random.uniform(-3.14, 3.14))
+		robot = WheelChair.WheelChairRobot(t_interval = 1.0,theta=random.uniform(-3.14, 3.14), phi=random.uniform(-3.14, 3.14), psi=random.uniform(-3.14, 3.14), integration=params['integration'])
 		curr_x = robot.x
 		current_state = robot.state
 		total_reward = 0
 		for j in range(params['episode_length']):
-			action = agent.select_action_index(current_state, True)
+			with Profiler.phase('select_action'):
+				action = agent.select_action_index(current_state, True)
 			phidot, psidot = get_action_from_index(action, params['action_lowest'], params['action_highest'], params['action_bins'])
-			robot.move((phidot, psidot))
+			with Profiler.phase('env_step'):
+				robot.move((phidot, psidot))
+			Profiler.count('env_steps')
 			reward = robot.x - curr_x
 			total_reward += reward
 			new_state = robot.state
-			agent.on_new_sample(current_state, action, reward, new_state)
-			agent.replay_mem(params['batch_size'])
+			with Profiler.phase('on_new_sample'):
+				agent.on_new_sample(current_state, action, reward, new_state)
+			scheduler.on_env_step(agent)
 			current_state = new_state
 			curr_x = robot.x
 		agent.on_terminated()
 		rewards_for_each_episode.append(total_reward)
+		Profiler.end_episode(run=run_iteration, episode=i, reward=total_reward)
+		if checkpoint_path is not None and i+1 < params['episodes'] and \
+				(i+1 == stop_episode or (params['checkpoint_interval'] > 0 and (i+1) % params['checkpoint_interval'] == 0)):
+			with Profiler.phase('checkpoint'):
+				Checkpoint.save(checkpoint_path, i+1, {'agent': agent.state_dict(), 'env_steps': scheduler.env_steps,
+														'rewards': rewards_for_each_episode, 'rng': Checkpoint.get_rng_state()})
 	agent.on_finished()
+	Profiler.write_trace(run_iteration)
 	return rewards_for_each_episode
 
 def set_seed(seed):
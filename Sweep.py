@@ -0,0 +1,212 @@
+import os
+import math
+import json
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import faiss
+import Shared
+import Checkpoint
+import Results
+import RunCache
+
+def available_cpus():
+	if hasattr(os, 'sched_getaffinity'):
+		return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count()))
+
+def init_worker(threads_per_worker, cpus, worker_counter):
+	"""
+	Runs once in every worker process: limits torch/FAISS intra-op threads and
+	pins the worker to its own block of threads_per_worker cpus.
+	"""
+	with worker_counter.get_lock():
+		worker_index = worker_counter.value
+		worker_counter.value += 1
+	torch.set_num_threads(threads_per_worker)
+	faiss.omp_set_num_threads(threads_per_worker)
+	if cpus is not None and hasattr(os, 'sched_setaffinity'):
+		start = worker_index * threads_per_worker
+		os.sched_setaffinity(0, {cpus[(start + i) % len(cpus)] for i in range(threads_per_worker)})
+
+def run_seed(params, agent_type, save_file_path, seed):
+	"""
+	Trains one agent with the given seed, continuing from its checkpoint when
+	params['resume'] is set, and appends its rewards to save_file_path.
+	"""
+	Shared.set_seed(seed)
+	agent = agent_type(params)
+	checkpoint_path = Shared.prepare_checkpoint(params, save_file_path, seed)
+	rewards = Shared.train_agent_and_sample_performance(agent, params, seed - 5, checkpoint_path)
+	Shared.record_result(params, agent_type, save_file_path, seed, rewards)
+	if checkpoint_path is not None:
+		Checkpoint.remove(checkpoint_path)
+	return rewards
+
+def run_seed_until(params, agent_type, save_file_path, seed, stop_episode):
+	"""
+	Trains one seed for its first stop_episode episodes, continuing from the
+	checkpoint an earlier call left behind. A seed that reaches
+	params['episodes'] is saved like run_seed and its checkpoint removed.
+	"""
+	Shared.set_seed(seed)
+	agent = agent_type(params)
+	checkpoint_path = Shared.get_checkpoint_path(save_file_path, seed)
+	rewards = Shared.train_agent_and_sample_performance(agent, params, seed - 5, checkpoint_path, stop_episode)[:stop_episode]
+	if stop_episode == params['episodes']:
+		Shared.record_result(params, agent_type, save_file_path, seed, rewards)
+		Checkpoint.remove(checkpoint_path)
+	return rewards
+
+def make_executor(workers, threads_per_worker, cpu_affinity):
+	cpus = available_cpus()
+	if workers is None:
+		workers = max(1, len(cpus) // threads_per_worker)
+	context = multiprocessing.get_context('spawn')
+	worker_counter = context.Value('i', 0)
+	initargs = (threads_per_worker, cpus if cpu_affinity else None, worker_counter)
+	return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=initargs)
+
+def run_sweep(configurations, agent_type, workers=None, threads_per_worker=1, cpu_affinity=True):
+	"""
+	Runs every seed of every configuration on a process pool. Seeds found in
+	the run cache are copied to their result directory instead of being run.
+	:param configurations: list of (params, save_file_path)
+	:param workers: number of worker processes, defaults to cpus // threads_per_worker
+	:return: dict from save_file_path to the list of reward curves of the seeds run or reused now
+	"""
+	results = {save_file_path: [] for _, save_file_path in configurations}
+	tasks = []
+	for params, save_file_path in configurations:
+		for seed in Shared.get_pending_seeds(params, save_file_path, agent_type):
+			key = RunCache.run_key(params, agent_type, seed)
+			rewards = RunCache.load(params, key)
+			if rewards is None:
+				tasks.append((params, agent_type, save_file_path, seed))
+			else:
+				Shared.save_result(save_file_path, rewards, seed, params, key)
+				results[save_file_path].append(rewards)
+	print(f'{sum(len(rewards) for rewards in results.values())} runs reused from the run cache, {len(tasks)} to run')
+
+	with make_executor(workers, threads_per_worker, cpu_affinity) as executor:
+		futures = [(task[2], executor.submit(run_seed, *task)) for task in tasks]
+		for save_file_path, future in futures:
+			results[save_file_path].append(future.result())
+	return results
+
+def get_halving_rungs(episodes, seeds, eta, min_episodes, min_seeds, configurations):
+	"""
+	:return: (episodes, seeds) budget of every rung, growing by eta up to the full budget.
+	There are at most ceil(log_eta(configurations)) + 1 rungs, since a single
+	configuration is left by then, and the last rung always has the full budget.
+	"""
+	for name, value in [('eta', eta), ('min_episodes', min_episodes), ('min_seeds', min_seeds)]:
+		if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+			raise ValueError(f'{name} must be a positive integer, got {value!r}')
+	if eta == 1:
+		raise ValueError('eta must be greater than 1')
+	max_rungs = 1
+	while eta ** (max_rungs - 1) < configurations:
+		max_rungs += 1
+	rungs = []
+	rung = 0
+	while len(rungs) == 0 or rungs[-1] != (episodes, seeds):
+		if len(rungs) == max_rungs - 1:
+			rungs.append((episodes, seeds))
+		else:
+			rungs.append((min(episodes, min_episodes * eta ** rung), min(seeds, min_seeds * eta ** rung)))
+		rung += 1
+	return rungs
+
+def score_rewards(reward_curves, metric_fraction):
+	"""
+	Mean reward over the last metric_fraction of the episodes, averaged over seeds.
+	"""
+	reward_curves = np.asarray(reward_curves, dtype=np.float64)
+	window = max(1, round(reward_curves.shape[1] * metric_fraction))
+	return float(reward_curves[:, -window:].mean())
+
+def load_completed_rewards(params, save_file_path, agent_type):
+	"""
+	:return: dict from seed to reward curve of the runs stored for save_file_path that count as done
+	"""
+	if params['resume'] != True and params['run_cache_path'] is None:
+		return {}
+	completed = Shared.get_completed_seeds(params, save_file_path, agent_type)
+	rewards = Results.load_rewards(save_file_path)
+	return {run['seed']: rewards[run['index']].tolist() for run in Results.load_runs(save_file_path) if run['seed'] in completed}
+
+def log_decision(log_path, decision):
+	print(f"rung {decision['rung']} ({decision['episodes']} episodes x {decision['seeds']} seeds): "
+		  f"{decision['decision']} {decision['configuration']} with score {decision['score']:.4f}")
+	if log_path is None:
+		return
+	if os.path.dirname(log_path):
+		os.makedirs(os.path.dirname(log_path), exist_ok=True)
+	with open(log_path, 'a') as file:
+		file.write(json.dumps(decision) + '\n')
+
+def run_successive_halving(configurations, agent_type, eta=2, min_episodes=25, min_seeds=10, metric_fraction=0.25,
+						   log_path=None, workers=None, threads_per_worker=1, cpu_affinity=True):
+	"""
+	Successive halving over configurations. Every rung trains the surviving
+	configurations on a growing budget of episodes and seeds, scores them
+	with score_rewards and promotes the best 1/eta of them to the next rung.
+	Promoted seeds continue from the checkpoint left at the end of the
+	previous rung, so a rung's rewards are the first episodes of the full
+	run, and seeds already stored or in the run cache are not trained at all. The
+	final rung runs the survivors to params['episodes'] x
+	params['run_times_for_performance_average'] and saves them like run_sweep.
+	Checkpoints of pruned and finished configurations are removed. Async
+	actors are not supported, since seeds continue from checkpoints.
+	:param configurations: list of (params, save_file_path), sharing episodes and run_times_for_performance_average
+	:param log_path: JSONL file every promote/prune decision is appended to, tagged with a sweep id and time
+	:return: dict from the save_file_path of every finished configuration to its reward curves
+	"""
+	if any(params['async_actors'] > 0 for params, _ in configurations):
+		raise ValueError('successive halving continues seeds from checkpoints, which async_actors > 0 does not support')
+	full_episodes = configurations[0][0]['episodes']
+	full_seeds = configurations[0][0]['run_times_for_performance_average']
+	rungs = get_halving_rungs(full_episodes, full_seeds, eta, min_episodes, min_seeds, len(configurations))
+	sweep_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+	survivors = list(configurations)
+	finished = {save_file_path: load_completed_rewards(params, save_file_path, agent_type) for params, save_file_path in configurations}
+	with make_executor(workers, threads_per_worker, cpu_affinity) as executor:
+		for rung, (episodes, seeds) in enumerate(rungs):
+			reward_curves = {save_file_path: {} for _, save_file_path in survivors}
+			futures = []
+			for params, save_file_path in survivors:
+				if params['resume'] != True and rung == 0:
+					Shared.remove_checkpoints(save_file_path, range(5, full_seeds + 5))
+				for seed in range(5, seeds + 5):
+					if seed not in finished[save_file_path]:
+						key = RunCache.run_key(params, agent_type, seed)
+						rewards = RunCache.load(params, key)
+						if rewards is not None:
+							Shared.save_result(save_file_path, rewards, seed, params, key)
+							finished[save_file_path][seed] = rewards
+					if seed in finished[save_file_path]:
+						reward_curves[save_file_path][seed] = finished[save_file_path][seed][:episodes]
+					else:
+						futures.append((save_file_path, seed, executor.submit(run_seed_until, params, agent_type, save_file_path, seed, episodes)))
+			for save_file_path, seed, future in futures:
+				reward_curves[save_file_path][seed] = future.result()
+				if episodes == full_episodes:
+					finished[save_file_path][seed] = reward_curves[save_file_path][seed]
+
+			scores = {save_file_path: score_rewards(list(curves.values()), metric_fraction) for save_file_path, curves in reward_curves.items()}
+			ranked = sorted(survivors, key=lambda configuration: scores[configuration[1]], reverse=True)
+			last_rung = rung == len(rungs) - 1
+			promoted = len(ranked) if last_rung else max(1, math.ceil(len(ranked) / eta))
+			for place, (params, save_file_path) in enumerate(ranked):
+				decision = 'finished' if last_rung else ('promoted' if place < promoted else 'pruned')
+				log_decision(log_path, {'sweep': sweep_id, 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'rung': rung, 'episodes': episodes,
+										'seeds': seeds, 'configuration': save_file_path, 'score': scores[save_file_path], 'place': place, 'decision': decision})
+				if decision != 'promoted':
+					Shared.remove_checkpoints(save_file_path, range(5, full_seeds + 5))
+			survivors = ranked[:promoted]
+	return {save_file_path: [reward_curves[save_file_path][seed] for seed in sorted(reward_curves[save_file_path])]
+			for _, save_file_path in survivors}
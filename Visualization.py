@@ -0,0 +1,71 @@
+"""
+Headless rendering of abstract state holder embeddings. Everything here works
+on plain NumPy arrays so a snapshot can be drawn in a background process;
+matplotlib (Agg canvas, no GUI backend) and sklearn are imported on use.
+"""
+import os
+import math
+import numpy as np
+
+def project_2d(X, seed):
+    if X.shape[1] == 2:
+        return X
+    from sklearn.manifold import TSNE
+    perplexity = min(30.0, max(1.0, (len(X) - 1) / 3))
+    return TSNE(n_components=2, perplexity=perplexity, init='pca', random_state=seed).fit_transform(X)
+
+def folded_angle_colors(next_states):
+    """
+    Original tile colours: the red channel fades as |theta| of the next state
+    moves away from the x axis (folded for x and y axis symmetry).
+    """
+    folded_angle = np.abs(next_states[:, 0])
+    folded_angle = np.where(folded_angle > math.pi / 2.0, math.pi - folded_angle, folded_angle)
+    red = np.round(255 - 255 * (folded_angle / (math.pi / 2.0))) / 255
+    return np.stack([red, np.full_like(red, 64 / 255), np.full_like(red, 64 / 255)], axis=1)
+
+def rounded(values, decimals):
+    # float64 first, float32 holder values would print as 1.7000000476837158
+    return tuple(np.round(np.asarray(values, dtype=np.float64), decimals).tolist())
+
+def point_labels(states, action_values, next_states, color_by_next_state):
+    if color_by_next_state:
+        return [f's:{rounded(next_state, 1)}' for next_state in next_states]
+    return [f's:{rounded(state, 1)}\na:{rounded(action, 2)}' for state, action in zip(states, action_values)]
+
+def render_embedding_snapshot(output_path, title, embeddings, states, action_values, next_states, color_by_next_state,
+                              reward_fixations=None, reward_labels=None, max_labels=200, seed=0):
+    """
+    Project embeddings (and reward fixations) to 2-D, normalise to [0, 1] and
+    save a labelled scatter plot to output_path.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    points = embeddings if reward_fixations is None else np.concatenate([embeddings, reward_fixations])
+    coordinates = project_2d(points, seed)
+    low, high = coordinates.min(axis=0), coordinates.max(axis=0)
+    coordinates = (coordinates - low) / np.where(high > low, high - low, 1.0)
+    holder_coordinates = coordinates[:len(embeddings)]
+
+    figure = Figure(figsize=(16, 16))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    colors = folded_angle_colors(next_states) if color_by_next_state else [(1.0, 64 / 255, 64 / 255)]
+    ax.scatter(holder_coordinates[:, 0], holder_coordinates[:, 1], c=colors, s=12)
+    labels = point_labels(states[:max_labels], action_values[:max_labels], next_states[:max_labels], color_by_next_state)
+    for (x, y), label in zip(holder_coordinates[:max_labels], labels):
+        ax.text(x, y, label, fontsize=6)
+
+    if reward_fixations is not None:
+        reward_coordinates = coordinates[len(embeddings):]
+        ax.scatter(reward_coordinates[:, 0], reward_coordinates[:, 1], c='k', marker='*', s=200)
+        for (x, y), reward in zip(reward_coordinates, reward_labels):
+            ax.text(x, y, f'r: {reward}', fontsize=12)
+
+    ax.set_xlim(-0.02, 1.02)
+    ax.set_ylim(-0.02, 1.02)
+    ax.set_title(title)
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    figure.savefig(output_path, dpi=100)
@@ -6,14 +6,26 @@ Wheelchair Model File
 from math import cos, sin, pi
 import numpy as np
 import random
-from scipy.integrate import quad, odeint
 
-# SET BACKEND
-import matplotlib as mpl
-mpl.use('TkAgg')
-import matplotlib.pyplot as plt
-import csv
-import time
+
+def analytic_integration(x, y, theta, phi, psi, dphi, dpsi, t, rho, w):
+	"""
+	Exact solution of the wheelchair kinematics for wheel speeds held
+	constant over [0, t]. theta is linear in time, so the x/y displacement
+	is v * t * sinc(omega * t / 2) along the heading at the midpoint,
+	which also covers the straight-line case omega == 0.
+	Works element-wise on scalars and NumPy arrays.
+	"""
+	v = rho / 2 * (dphi + dpsi)
+	omega = rho / w * (dphi - dpsi)
+	half_turn = omega * t / 2
+	distance = v * t * np.sinc(half_turn / pi)
+	mid_theta = theta + half_turn
+	return (x + distance * np.cos(mid_theta),
+		y + distance * np.sin(mid_theta),
+		theta + omega * t,
+		phi + dphi * t,
+		psi + dpsi * t)
 
 
 class WheelChairRobot(object):
@@ -26,7 +38,8 @@ class WheelChairRobot(object):
 		rho = 3.0,
 		w = 3.0,
 		t_interval=0.25,
-		timestep=1):
+		timestep=1,
+		integration='odeint'):
 
 		self.init_x = x
 		self.init_y = y
@@ -51,6 +64,7 @@ class WheelChairRobot(object):
 		self.timestep = timestep
 		self.rho = rho
 		self.w = w
+		self.integration = integration
 
 		self.state = (self.theta, self.phi, self.psi)
 
@@ -127,6 +141,10 @@ class WheelChairRobot(object):
 		if(t_interval == 0):
 			return self.x, self.y, self.theta, self.phi, self.psi
 		phidot, psidot = action
+		if self.integration == 'analytic':
+			solution = analytic_integration(self.x, self.y, self.theta, self.phi, self.psi, phidot, psidot, t_interval, self.rho, self.w)
+			return tuple(float(value) for value in solution)
+		from scipy.integrate import odeint # only the reference integration needs scipy
 		v0 = [self.x, self.y, self.theta, self.phi, self.psi]
 		t = np.linspace(0, t_interval, 11)
 		sol = odeint(self.robot, v0, t, args=(phidot, psidot))
@@ -211,4 +229,147 @@ class WheelChairRobot(object):
 		self.update_dots(phidot, psidot, t)
 
 		self.theta_displacement = d_theta
-		self.state = (self.theta, self.phi, self.psi)
\ No newline at end of file
+		self.state = (self.theta, self.phi, self.psi)
+
+class VectorWheelChair(object):
+	"""
+	Batch of n independent wheelchair robots stepped together.
+	State is held in NumPy arrays of shape (n,) and all robots are
+	integrated in a single odeint call (or in closed form with
+	integration='analytic').
+	"""
+	def __init__(self,
+		n,
+		x = 0.0,
+		y = 0.0,
+		theta = 0.0,
+		phi = 0.0,
+		psi = 0.0,
+		rho = 3.0,
+		w = 3.0,
+		t_interval=0.25,
+		timestep=1,
+		action_lowest=-1.0,
+		action_highest=1.0,
+		action_bins=9,
+		integration='odeint'):
+
+		self.n = n
+		self.init_x = self.to_array(x)
+		self.init_y = self.to_array(y)
+		self.init_theta = self.to_array(theta)
+		self.init_phi = self.to_array(phi)
+		self.init_psi = self.to_array(psi)
+
+		#constants
+		self.t_interval = t_interval
+		self.timestep = timestep
+		self.rho = rho
+		self.w = w
+		self.action_lowest = action_lowest
+		self.action_highest = action_highest
+		self.action_bins = action_bins
+		self.integration = integration
+
+		self.reset()
+
+	def to_array(self, value):
+		return np.array(np.broadcast_to(value, (self.n,)), dtype=np.float64)
+
+	@property
+	def state(self):
+		return np.stack([self.theta, self.phi, self.psi], axis=1)
+
+	def reset(self):
+		self.x = self.init_x.copy()
+		self.y = self.init_y.copy()
+		self.theta = self.init_theta.copy()
+		self.phi = self.init_phi.copy()
+		self.psi = self.init_psi.copy()
+
+		self.theta_displacement = np.zeros(self.n)
+		self.psidot = np.zeros(self.n)
+		self.phidot = np.zeros(self.n)
+		return self.state
+
+	def set_state(self, theta, phi, psi):
+		self.theta = self.to_array(theta)
+		self.phi = self.to_array(phi)
+		self.psi = self.to_array(psi)
+		return self.state
+
+	def get_position(self):
+		return self.x, self.y
+
+	def get_actions_from_indices(self, action_indices):
+		"""
+		:param action_indices: integer array of shape (n,) in [0, action_bins ** 2)
+		:return: array of shape (n, 2) holding (phidot, psidot) for each robot
+		"""
+		action_indices = np.asarray(action_indices)
+		bin_size = (self.action_highest - self.action_lowest) / (self.action_bins - 1)
+		phidot = (action_indices // self.action_bins) * bin_size + self.action_lowest
+		psidot = (action_indices % self.action_bins) * bin_size + self.action_lowest
+		return np.stack([phidot, psidot], axis=1)
+
+	def robots(self, v, t, dphi, dpsi):
+		theta = v[2 * self.n:3 * self.n]
+		forward = self.rho / 2 * (dphi + dpsi)
+		xdot = forward * np.cos(theta)
+		ydot = forward * np.sin(theta)
+		thetadot = self.rho / self.w * (dphi - dpsi)
+		return np.concatenate([xdot, ydot, thetadot, dphi, dpsi])
+
+	def perform_integration(self, actions, t_interval):
+		if(t_interval == 0):
+			return self.x, self.y, self.theta, self.phi, self.psi
+		phidot, psidot = actions[:, 0], actions[:, 1]
+		if self.integration == 'analytic':
+			return analytic_integration(self.x, self.y, self.theta, self.phi, self.psi, phidot, psidot, t_interval, self.rho, self.w)
+		from scipy.integrate import odeint
+		v0 = np.concatenate([self.x, self.y, self.theta, self.phi, self.psi])
+		t = np.linspace(0, t_interval, 11)
+		sol = odeint(self.robots, v0, t, args=(phidot, psidot))
+		x, y, theta, phi, psi = sol[-1].reshape(5, self.n)
+		return x, y, theta, phi, psi
+
+	@staticmethod
+	def enforce_angle_range(angle):
+		"""
+		Array version of WheelChairRobot.enforce_angle_range.
+		"""
+		angle = np.asarray(angle, dtype=np.float64)
+		above = np.mod(angle, 2 * pi)
+		above = np.where(above > pi, above - 2 * pi, above)
+		below = np.mod(angle, -2 * pi)
+		below = np.where(below < -pi, below + 2 * pi, below)
+		return np.where(angle > pi, above, np.where(angle < -pi, below, angle))
+
+	def move(self, actions, timestep = 1):
+		"""
+		:param actions: array of shape (n, 2) holding (phidot, psidot) for each robot
+		"""
+		self.timestep = timestep
+		actions = np.asarray(actions, dtype=np.float64)
+		t = self.timestep * self.t_interval
+
+		old_theta = self.theta
+		x, y, theta, phi, psi = self.perform_integration(actions, t)
+		self.theta_displacement = theta - old_theta
+		self.x = x
+		self.y = y
+		self.theta = self.enforce_angle_range(theta)
+		self.phi = self.enforce_angle_range(phi)
+		self.psi = self.enforce_angle_range(psi)
+		self.phidot = actions[:, 0].copy()
+		self.psidot = actions[:, 1].copy()
+		return self.state
+
+	def step(self, action_indices, timestep = 1):
+		"""
+		Move every robot by its action index.
+		:return: next states of shape (n, 3) and rewards (x displacement) of shape (n,)
+		"""
+		old_x = self.x
+		next_states = self.move(self.get_actions_from_indices(action_indices), timestep)
+		return next_states, self.x - old_x
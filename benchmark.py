@@ -0,0 +1,150 @@
+"""
+CPU benchmarks for the environment, replay updates, holder KNN and end-to-end
+training. Results are written as JSON so runs can be compared across commits:
+
+	python benchmark.py --output before.json
+	python benchmark.py --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import numpy as np
+import torch
+import faiss
+import Shared
+import WheelChair
+import DQN
+import DQN_Equivalent
+import equivalence
+
+def timed_rate(function, repeats, warmup=1):
+	"""
+	:return: calls of function per second
+	"""
+	for _ in range(warmup):
+		function()
+	start = time.perf_counter()
+	for _ in range(repeats):
+		function()
+	return repeats / (time.perf_counter() - start)
+
+def benchmark_environment(steps):
+	results = {}
+	for integration in ['odeint', 'analytic']:
+		robot = WheelChair.WheelChairRobot(t_interval=1.0, theta=0.3, phi=0.2, psi=-0.1, integration=integration)
+		results[f'wheelchair_move_{integration}_steps_per_sec'] = timed_rate(lambda: robot.move((0.5, -0.25)), steps)
+	for n in [1, 100]:
+		robots = WheelChair.VectorWheelChair(n, t_interval=1.0, integration='analytic')
+		action_indices = np.random.randint(0, robots.action_bins ** 2, n)
+		results[f'vector_wheelchair_{n}_robot_steps_per_sec'] = n * timed_rate(lambda: robots.step(action_indices), steps)
+	return results
+
+def fill_memory(agent, params, transitions):
+	robot = WheelChair.WheelChairRobot(t_interval=1.0, integration='analytic')
+	state = robot.state
+	for _ in range(transitions):
+		action = random.randrange(params['number_of_actions'])
+		x = robot.x
+		robot.move(Shared.get_action_from_index(action, params['action_lowest'], params['action_highest'], params['action_bins']))
+		agent.on_new_sample(state, action, robot.x - x, robot.state)
+		state = robot.state
+
+def benchmark_replay(updates, transitions, compile_variants=(False,)):
+	results = {}
+	for compiled in compile_variants:
+		# compiled losses are checked against eager and compiled during warm-up
+		suffix, warmup = ('_compiled', 20) if compiled else ('', 1)
+		params = Shared.parameters()
+		params['compile_training_step'] = compiled
+		agent = DQN.DQNAgent(params)
+		fill_memory(agent, params, transitions)
+		results[f'dqn_replay_mem{suffix}_updates_per_sec'] = timed_rate(lambda: agent.replay_mem(params['batch_size']), updates, warmup)
+
+		params = equivalence.define_parameters()
+		params['compile_training_step'] = compiled
+		agent = DQN_Equivalent.DQNAgent(params)
+		fill_memory(agent, params, transitions)
+		agent.update_all_in_abstract_state_holders()
+		results[f'equivalent_replay_mem{suffix}_updates_per_sec'] = timed_rate(lambda: agent.replay_mem(params['batch_size']), updates, warmup)
+		results[f'equivalent_replay_abstract_model{suffix}_updates_per_sec'] = timed_rate(agent.replay_abstract_model, updates, warmup)
+	return results
+
+def benchmark_knn(sizes, ks, queries, index_types):
+	results = {}
+	params = equivalence.define_parameters()
+	dimension = params['abstract_state_space_dimmension']
+	for size in sizes:
+		X = np.random.rand(size, dimension).astype(np.float32)
+		ids = np.arange(size)
+		for index_type in index_types:
+			name = 'knn' if index_type == 'flat' else f'knn_{index_type}'
+			for k in ks:
+				params['knn_index'] = index_type
+				params['K_for_KNN'] = k
+				knn_model = DQN_Equivalent.make_knn_model(params)
+				results[f'{name}_fit_{size}_k{k}_ms'] = 1000 / timed_rate(lambda: knn_model.fit(ids, X), 1 if index_type == 'hnsw' else 5)
+				batch = np.random.randint(0, size, 16)
+				results[f'{name}_query_batch16_{size}_k{k}_us'] = 1e6 / timed_rate(lambda: knn_model.kneighbors(X[batch]), queries)
+				if index_type != 'flat':
+					results[f'{name}_recall_{size}_k{k}'] = DQN_Equivalent.knn_recall(knn_model, ids, X, X[np.random.randint(0, size, 256)])
+				updated = np.random.randint(0, size, 32)
+				results[f'{name}_update_batch32_{size}_k{k}_us'] = 1e6 / timed_rate(lambda: knn_model.update(updated, X[updated]), queries)
+	return results
+
+def benchmark_end_to_end(episodes):
+	results = {}
+	for name, agent_type, params in [('dqn', DQN.DQNAgent, Shared.parameters()), ('equivalent', DQN_Equivalent.DQNAgent, equivalence.define_parameters())]:
+		params['episodes'] = episodes
+		Shared.set_seed(5)
+		agent = agent_type(params)
+		start = time.perf_counter()
+		Shared.train_agent_and_sample_performance(agent, params, 0)
+		results[f'{name}_episodes_per_sec'] = episodes / (time.perf_counter() - start)
+	return results
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def compare(results, baseline_path):
+	with open(baseline_path, 'r') as file:
+		baseline = json.load(file)['results']
+	print('ratio = current / baseline; higher is better for *_per_sec, lower for *_ms and *_us')
+	print(f'{"benchmark":<55}{"baseline":>14}{"current":>14}{"ratio":>8}')
+	for name, value in results.items():
+		if name in baseline:
+			print(f'{name:<55}{baseline[name]:>14.3f}{value:>14.3f}{value / baseline[name]:>8.2f}')
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--output', default='benchmark.json')
+	parser.add_argument('--compare', help='baseline JSON to compare against')
+	parser.add_argument('--quick', action='store_true', help='fewer repetitions and smaller sizes')
+	parser.add_argument('--threads', type=int, default=1, help='torch/FAISS threads')
+	parser.add_argument('--compile', action='store_true', help='also time replay updates with compile_training_step')
+	args = parser.parse_args()
+
+	torch.set_num_threads(args.threads)
+	faiss.omp_set_num_threads(args.threads)
+	Shared.set_seed(0)
+	scale = 0.1 if args.quick else 1.0
+	results = {}
+	results.update(benchmark_environment(int(2000 * scale)))
+	results.update(benchmark_replay(int(200 * scale), 2000, (False, True) if args.compile else (False,)))
+	results.update(benchmark_knn([1000, 10000] if args.quick else [1000, 10000, 100000], [3, 11], int(500 * scale), ['flat', 'ivf', 'hnsw']))
+	results.update(benchmark_end_to_end(2 if args.quick else 10))
+
+	report = {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'threads': args.threads,
+			'python': sys.version.split()[0], 'torch': torch.__version__, 'results': results}
+	with open(args.output, 'w') as file:
+		json.dump(report, file, indent=2)
+	for name, value in results.items():
+		print(f'{name:<55}{value:>14.3f}')
+	if args.compare is not None:
+		compare(results, args.compare)
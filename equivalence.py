@@ -1,6 +1,6 @@
 import Shared
+import Sweep
 from DQN_Equivalent import DQNAgent, DEVICE
-import threading
 import copy
 
 def define_parameters():
@@ -13,27 +13,61 @@ def define_parameters():
 	params['equivalence_weight'] = 1.0
 	params['abstract_state_holders_size'] = params['memory_size']
 	params['reward_filter'] = True
+	params['factorized_action_encoder'] = True
+
+	# holder nearest-neighbour index (DQN_Equivalent.make_knn_model)
+	params['knn_index'] = 'flat' # 'flat' (exact), 'ivf' or 'hnsw' (approximate, sub-linear queries)
+	params['knn_nlist'] = 256 # ivf: clusters, trained once there are 39 * knn_nlist holders
+	params['knn_nprobe'] = 16 # ivf: clusters scanned per query
+	params['knn_retrain_interval'] = 20 # ivf: refits between cluster retraining, hnsw: refits between graph rebuilds
+	params['knn_hnsw_m'] = 32 # hnsw: graph neighbours per point
+	params['knn_ef_search'] = 64 # hnsw: search beam width
+	params['knn_rebuild_fraction'] = 0.1 # hnsw: rebuild the graph once this fraction of holders changed since it was built
+	params['knn_rebuild_min_points'] = 1024 # hnsw: ... and at least this many, the changed points are searched exactly until then
+	params['knn_recall_interval'] = 0 # episodes between recall@K measurements against exact search, 0 disables
+
+	# holder embedding refresh: 'full' re-encodes every holder at each episode start,
+	# 'incremental' re-encodes holder_refresh_chunk holders after every abstraction step
+	params['holder_refresh'] = 'full'
+	params['holder_refresh_chunk'] = 256
+	params['holder_refresh_order'] = 'round_robin' # or 'oldest'
+	params['holder_refresh_drift_threshold'] = None # incremental: mean embedding shift of a chunk that triggers a full refresh
+
+	# 'grid' runs every configuration to the full budget, 'successive_halving' prunes
+	# configurations on partial budgets first (Sweep.run_successive_halving)
+	params['sweep_scheduler'] = 'grid'
+	params['halving_eta'] = 2 # 1/eta of the configurations are promoted, budgets grow by eta per rung
+	params['halving_min_episodes'] = 25 # episodes of the first rung
+	params['halving_min_seeds'] = 10 # seeds of the first rung
+	params['halving_metric_fraction'] = 0.25 # configurations are ranked by their mean reward over this last fraction of the rung's episodes
+	params['halving_log_path'] = 'result/successive_halving.jsonl'
 
 	# to debug mapping
 	params['plot_t-sne'] = False
 	params['t-sne_next_state'] = True
 	params['plot_reward_fixations'] = False
+	params['t-sne_output_path'] = 'equivalent_result/t-sne/episode_{episode}.png'
+	params['t-sne_max_points'] = 2000 # holders are subsampled to this many points
+	params['t-sne_max_labels'] = 200 # text labels drawn for at most this many points
+	params['t-sne_background'] = True # render in a separate process instead of stalling training
 	return params
 
-params = define_parameters()
-action = params['action_bins']
-if params['plot_t-sne'] == True:	
-	Shared.run(params, DQNAgent, f'equivalent_result/t-sne')
-
-threads = []
-for k in [3,7,11]:
-	for reward_filter, weight in [(False, 0.6),(True,1.0)]:
-		params['K_for_KNN'] = k
-		params['equivalence_weight'] = weight
-		params['reward_filter'] = reward_filter
-		thread = threading.Thread(target=Shared.run, args=(copy.deepcopy(params), DQNAgent, f'result/{action}_equivalent({k})-{weight},filter({reward_filter})'))
-		thread.start()
-		threads.append(thread)
-
-for thread in threads:
-	thread.join()
\ No newline at end of file
+if __name__ == '__main__':
+	params = define_parameters()
+	action = params['action_bins']
+	if params['plot_t-sne'] == True:	
+		Shared.run(params, DQNAgent, f'equivalent_result/t-sne')
+
+	configurations = []
+	for k in [3,7,11]:
+		for reward_filter, weight in [(False, 0.6),(True,1.0)]:
+			params['K_for_KNN'] = k
+			params['equivalence_weight'] = weight
+			params['reward_filter'] = reward_filter
+			configurations.append((copy.deepcopy(params), f'result/{action}_equivalent({k})-{weight},filter({reward_filter})'))
+
+	if params['sweep_scheduler'] == 'successive_halving':
+		Sweep.run_successive_halving(configurations, DQNAgent, params['halving_eta'], params['halving_min_episodes'], params['halving_min_seeds'],
+									 params['halving_metric_fraction'], params['halving_log_path'], params['workers'], params['threads_per_worker'], params['cpu_affinity'])
+	else:
+		Sweep.run_sweep(configurations, DQNAgent, params['workers'], params['threads_per_worker'], params['cpu_affinity'])
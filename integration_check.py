@@ -0,0 +1,55 @@
+"""
+Checks the closed-form wheelchair integration against the odeint reference
+over random states and actions, for both WheelChairRobot and VectorWheelChair.
+"""
+import sys
+import numpy as np
+import WheelChair
+
+samples = 1000
+tolerance = 1e-6
+rng = np.random.default_rng(0)
+
+def random_angles(n):
+	return rng.uniform(-np.pi, np.pi, n)
+
+def angle_error(a, b):
+	return np.abs(np.angle(np.exp(1j * (np.asarray(a) - np.asarray(b)))))
+
+def check_single_robot():
+	max_error = 0.0
+	for _ in range(samples):
+		x, y = rng.uniform(-10, 10, 2)
+		theta, phi, psi = random_angles(3)
+		action = tuple(rng.uniform(-1.0, 1.0, 2))
+		t_interval = rng.choice([0.25, 1.0])
+		robots = [WheelChair.WheelChairRobot(x=x, y=y, theta=theta, phi=phi, psi=psi, t_interval=t_interval, integration=integration) for integration in ['odeint', 'analytic']]
+		for robot in robots:
+			robot.move(action)
+		reference, analytic = robots
+		max_error = max(max_error, abs(reference.x - analytic.x), abs(reference.y - analytic.y),
+			np.max(angle_error(reference.state, analytic.state)))
+	return max_error
+
+def check_vector_robot():
+	n = samples
+	kwargs = dict(x=rng.uniform(-10, 10, n), y=rng.uniform(-10, 10, n), theta=random_angles(n), phi=random_angles(n), psi=random_angles(n), t_interval=1.0)
+	reference = WheelChair.VectorWheelChair(n, integration='odeint', **kwargs)
+	analytic = WheelChair.VectorWheelChair(n, integration='analytic', **kwargs)
+	max_error = 0.0
+	for _ in range(20):
+		action_indices = rng.integers(0, reference.action_bins ** 2, n)
+		reference.step(action_indices)
+		analytic.step(action_indices)
+		max_error = max(max_error, np.max(np.abs(reference.x - analytic.x)), np.max(np.abs(reference.y - analytic.y)),
+			np.max(angle_error(reference.state, analytic.state)))
+	return max_error
+
+single_error = check_single_robot()
+vector_error = check_vector_robot()
+print(f'max error WheelChairRobot: {single_error:.3e}')
+print(f'max error VectorWheelChair (20 steps): {vector_error:.3e}')
+if max(single_error, vector_error) > tolerance:
+	print(f'FAILED: analytic integration differs from odeint by more than {tolerance}')
+	sys.exit(1)
+print('OK')
@@ -1,6 +1,12 @@
 import Shared
+import Sweep
+import Ensemble
 from DQN import DQNAgent, DEVICE
 
-params = Shared.parameters()
-action = params['action_bins']
-rewards = Shared.run(params, DQNAgent, f"result/{action}_no_equivalence")
\ No newline at end of file
+if __name__ == '__main__':
+	params = Shared.parameters()
+	action = params['action_bins']
+	if params['ensemble_size'] > 1:
+		Ensemble.run_ensemble(params, f"result/{action}_no_equivalence")
+	else:
+		Sweep.run_sweep([(params, f"result/{action}_no_equivalence")], DQNAgent, params['workers'], params['threads_per_worker'], params['cpu_affinity'])